@@ -25,15 +25,25 @@ class Config:
     MIKROTIK_PORT = int(os.environ.get('MIKROTIK_PORT', '8728'))
     MIKROTIK_USE_SSL = os.environ.get('MIKROTIK_USE_SSL', 'False').lower() == 'true'
     MIKROTIK_SSL_VERIFY = os.environ.get('MIKROTIK_SSL_VERIFY', 'False').lower() == 'true'
+    MIKROTIK_POOL_SIZE = int(os.environ.get('MIKROTIK_POOL_SIZE', '8'))
     
     # M-Pesa settings
     MPESA_CONSUMER_KEY = os.environ.get('MPESA_CONSUMER_KEY', 'your_consumer_key')
     MPESA_CONSUMER_SECRET = os.environ.get('MPESA_CONSUMER_SECRET', 'your_consumer_secret')
     MPESA_PAYBILL = os.environ.get('MPESA_PAYBILL', '123456')
+    MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY', 'your_passkey')
     MPESA_ENVIRONMENT = os.environ.get('MPESA_ENVIRONMENT', 'sandbox')
+    MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', 'https://your-domain.com/api/mpesa-callback')
+    # Secret sent to Daraja as part of the callback URL; callbacks without it
+    # are refused (and all of them are while it is unset)
+    MPESA_CALLBACK_TOKEN = os.environ.get('MPESA_CALLBACK_TOKEN', '')
     
     # Database settings
     DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///hotspot.db')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+    
+    # Cache settings (leave REDIS_URL empty to keep caches per-process)
+    REDIS_URL = os.environ.get('REDIS_URL', '')
     
     # Server settings
     HOST = os.environ.get('HOST', '0.0.0.0')
@@ -67,7 +77,9 @@ class ProductionConfig(Config):
     MPESA_CONSUMER_KEY = os.environ.get('MPESA_CONSUMER_KEY')
     MPESA_CONSUMER_SECRET = os.environ.get('MPESA_CONSUMER_SECRET')
     MPESA_PAYBILL = os.environ.get('MPESA_PAYBILL')
+    MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY')
     MPESA_ENVIRONMENT = os.environ.get('MPESA_ENVIRONMENT', 'production')
+    MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL')
 
 class TestingConfig(Config):
     """Testing configuration"""
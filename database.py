@@ -1,115 +1,359 @@
 import sqlite3
 import hashlib
-import datetime
+import hmac
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from typing import Dict, List, Optional
 
+# Per-connection settings; journal_mode is persisted in the file and set once in init_database
+_CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-64000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+# scrypt cost parameters for user passwords (~16 MiB, tens of ms per hash)
+_SCRYPT_N = 16384
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+_SALT_BYTES = 16
+
+# Hot-path statements kept as constants so every caller shares one entry in
+# each pooled connection's prepared-statement cache
+_INSERT_TRANSACTION_SQL = '''
+    INSERT INTO transactions (user_id, package_id, amount, payment_method, phone_number, transaction_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+# Single-row inserts echo SQLite's own id and created_at back to the caller
+_INSERT_TRANSACTION_RETURNING_SQL = _INSERT_TRANSACTION_SQL + 'RETURNING id, created_at'
+_UPDATE_TRANSACTION_STATUS_SQL = '''
+    UPDATE transactions
+    SET status = ?1, completed_at = CASE WHEN ?1 = 'completed' THEN CURRENT_TIMESTAMP END
+    WHERE id = ?2
+'''
+# Looks up the package and computes its (UTC) expiry in the same statement
+_ASSIGN_PACKAGE_SQL = '''
+    UPDATE users
+    SET current_package_id = ?,
+        package_expires_at = datetime('now', printf('+%d hours',
+            (SELECT duration_hours FROM packages WHERE id = ? AND is_active = 1)))
+    WHERE id = ?
+      AND EXISTS (SELECT 1 FROM packages WHERE id = ? AND is_active = 1)
+'''
+_UPDATE_LAST_LOGIN_SQL = '''
+    UPDATE users
+    SET last_login = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+_STATEMENT_CACHE_SIZE = 256
+
+# Bump whenever init_database gains new DDL so existing files are migrated
+_SCHEMA_VERSION = 5
+
+# How long package listings are served from memory before re-reading SQLite
+_PACKAGE_CACHE_TTL = 300
+
+def _hash_password(password: str, salt: bytes) -> str:
+    """Derive the stored password hash with scrypt"""
+    return hashlib.scrypt(password.encode(), salt=salt, n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P, dklen=32).hex()
+
+class _ConnectionPool:
+    """Fixed-size pool of SQLite connections shared across request threads"""
+
+    def __init__(self, factory, size: int = 5):
+        self._factory = factory
+        self._size = size
+        self._created = 0
+        self._lock = threading.Lock()
+        self._idle = queue.Queue(maxsize=size)
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one while under the size limit"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self._size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool exhausted - wait for another thread to hand one back
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool"""
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
 class Database:
-    def __init__(self, db_path: str = "hotspot.db"):
+    def __init__(self, db_path: str = "hotspot.db", pool_size: int = 5):
         self.db_path = db_path
+        self._pool = _ConnectionPool(self.get_connection, size=pool_size)
+        self._package_cache = {}
+        self._package_cache_version = 0
+        self._package_cache_lock = threading.Lock()
         self.init_database()
-    
+
     def get_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
+        """Open a new database connection (used by the pool)"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=_STATEMENT_CACHE_SIZE)
         conn.row_factory = sqlite3.Row  # This allows accessing columns by name
+
+        # Pragmas are per-connection, so apply them to every pooled connection
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
-    
+
+    @contextmanager
+    def _get_conn(self):
+        """Borrow a pooled connection for the duration of a with-block"""
+        conn = self._pool.acquire()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.release(conn)
+
+    def close(self):
+        """Close all pooled connections"""
+        self._pool.close_all()
+
+    def invalidate_package_cache(self):
+        """Drop cached package listings after the packages table changes"""
+        with self._package_cache_lock:
+            self._package_cache_version += 1
+            self._package_cache.clear()
+
+    def _cached_packages(self, key, loader):
+        """Serve a package query from the TTL cache, running loader() on a miss"""
+        now = time.monotonic()
+        with self._package_cache_lock:
+            entry = self._package_cache.get(key)
+            version = self._package_cache_version
+        if entry and entry[0] > now:
+            packages = entry[1]
+        else:
+            packages = loader()
+            with self._package_cache_lock:
+                # Skip the store if an invalidation raced with the query
+                if version == self._package_cache_version:
+                    self._package_cache[key] = (now + _PACKAGE_CACHE_TTL, packages)
+
+        # Hand out copies so callers can't mutate the cached results;
+        # sqlite3.Row is immutable, so listings only need a new list
+        if packages is None:
+            return None
+        if isinstance(packages, dict):
+            return dict(packages)
+        return list(packages)
+
     def init_database(self):
         """Initialize database tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Users table with MAC address support
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE,
-                password TEXT,
-                phone_number TEXT NOT NULL,
-                email TEXT,
-                mac_address TEXT UNIQUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1,
-                mikrotik_user_id TEXT,
-                current_package_id INTEGER,
-                package_expires_at TIMESTAMP
-            )
-        ''')
-        
-        # Add MAC address column if it doesn't exist (for existing databases)
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN mac_address TEXT UNIQUE')
-        except sqlite3.OperationalError:
-            # Column already exists
-            pass
-        
-        # Packages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS packages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                price DECIMAL(10,2) NOT NULL,
-                duration_hours INTEGER NOT NULL,
-                data_limit_gb INTEGER,
-                speed_limit_mbps INTEGER,
-                package_type TEXT NOT NULL, -- 'daily', 'weekly', 'monthly'
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Transactions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                package_id INTEGER NOT NULL,
-                amount DECIMAL(10,2) NOT NULL,
-                payment_method TEXT NOT NULL, -- 'mpesa', 'airtel', 'voucher'
-                transaction_id TEXT,
-                status TEXT DEFAULT 'pending', -- 'pending', 'completed', 'failed'
-                phone_number TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (package_id) REFERENCES packages (id)
-            )
-        ''')
-        
-        # User sessions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                session_token TEXT UNIQUE NOT NULL,
-                ip_address TEXT,
-                mac_address TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Insert default packages if they don't exist
-        self.insert_default_packages()
-        
-        conn.commit()
-        conn.close()
-    
-    def insert_default_packages(self):
-        """Insert default packages into the database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+        with self._get_conn() as conn:
+            # Let freed pages be reclaimed by housekeeping() without a full
+            # VACUUM; only takes effect on a database with no tables yet
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+
+            # WAL lets readers proceed while a payment write is in flight
+            conn.execute('PRAGMA journal_mode=WAL')
+
+            # Run all of the schema setup in one transaction (one fsync)
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+
+            # Another worker may already have brought the schema up to date
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] >= _SCHEMA_VERSION:
+                conn.commit()
+                return
+
+            # Users table with MAC address support
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE,
+                    password TEXT,
+                    password_salt TEXT,
+                    phone_number TEXT NOT NULL,
+                    email TEXT,
+                    mac_address TEXT UNIQUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP,
+                    is_active BOOLEAN DEFAULT 1,
+                    mikrotik_user_id TEXT,
+                    current_package_id INTEGER,
+                    package_expires_at TIMESTAMP
+                )
+            ''')
+
+            # Add columns missing from databases created by older versions
+            user_columns = {row[1] for row in cursor.execute('PRAGMA table_info(users)')}
+            if 'mac_address' not in user_columns:
+                # SQLite can't ADD a UNIQUE column, so enforce it with an index
+                cursor.execute('ALTER TABLE users ADD COLUMN mac_address TEXT')
+                cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_mac ON users(mac_address)')
+            if 'password_salt' not in user_columns:
+                cursor.execute('ALTER TABLE users ADD COLUMN password_salt TEXT')
+
+            # Older versions stored expiries as Python local time with
+            # microseconds ('YYYY-MM-DD HH:MM:SS.ffffff'); rewrite them as the
+            # UTC 'YYYY-MM-DD HH:MM:SS' that check_user_package_status compares
+            cursor.execute('''
+                UPDATE users SET package_expires_at = datetime(package_expires_at, 'utc')
+                WHERE length(package_expires_at) > 19
+            ''')
+
+            # Packages table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS packages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    description TEXT,
+                    price DECIMAL(10,2) NOT NULL,
+                    duration_hours INTEGER NOT NULL,
+                    data_limit_gb INTEGER,
+                    speed_limit_mbps INTEGER,
+                    package_type TEXT NOT NULL, -- 'daily', 'weekly', 'monthly'
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Transactions table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    package_id INTEGER NOT NULL,
+                    amount DECIMAL(10,2) NOT NULL,
+                    payment_method TEXT NOT NULL, -- 'mpesa', 'airtel', 'voucher'
+                    transaction_id TEXT,
+                    status TEXT DEFAULT 'pending', -- 'pending', 'completed', 'failed'
+                    phone_number TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    completed_at TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (package_id) REFERENCES packages (id)
+                )
+            ''')
+
+            # User sessions table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    session_token TEXT UNIQUE NOT NULL,
+                    ip_address TEXT,
+                    mac_address TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    expires_at TIMESTAMP,
+                    is_active BOOLEAN DEFAULT 1,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+
+            # Tracking rows from older versions have no id; they only live a
+            # day, so set them aside and copy them into the new layout below
+            request_columns = {row[1] for row in cursor.execute('PRAGMA table_info(payment_requests)')}
+            if request_columns and 'id' not in request_columns:
+                cursor.execute('ALTER TABLE payment_requests RENAME TO payment_requests_old')
+
+            # STK pushes sent in the background, polled by tracking id; the
+            # id (never reused) becomes the M-Pesa account reference
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS payment_requests (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tracking_id TEXT UNIQUE NOT NULL,
+                    status TEXT DEFAULT 'pending', -- 'pending', 'sent', 'failed'
+                    checkout_request_id TEXT,
+                    customer_message TEXT,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            if request_columns and 'id' not in request_columns:
+                cursor.execute('''
+                    INSERT INTO payment_requests
+                        (tracking_id, status, checkout_request_id, customer_message, error, created_at)
+                    SELECT tracking_id, status, checkout_request_id, customer_message, error, created_at
+                    FROM payment_requests_old
+                ''')
+                cursor.execute('DROP TABLE payment_requests_old')
+
+            # Indexes for the hot lookup paths
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_user ON transactions(user_id, created_at DESC)')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_status ON transactions(status) WHERE status = 'pending'")
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_pkg_type_active ON packages(package_type, is_active, price)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_pkg_exp ON users(package_expires_at) WHERE current_package_id IS NOT NULL')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_checkout ON transactions(transaction_id)')
+
+            # Insert default packages if they don't exist
+            self.insert_default_packages(cursor)
+
+            # Refresh planner statistics so the indexes above are picked up
+            cursor.execute('ANALYZE')
+
+            cursor.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+            conn.commit()
+
+    def housekeeping(self, max_pages: int = 1000):
+        """Prune stale payment tracking rows, reclaim free pages and refresh
+        planner statistics (run periodically)"""
+        with self._get_conn() as conn:
+            # Payment tracking ids are only polled for a few minutes
+            conn.execute("DELETE FROM payment_requests WHERE created_at < datetime('now', '-1 day')")
+            conn.commit()
+
+            # incremental_vacuum frees pages as it is stepped, so drain it
+            conn.execute(f'PRAGMA incremental_vacuum({int(max_pages)})').fetchall()
+            conn.execute('ANALYZE')
+            conn.commit()
+
+    def insert_default_packages(self, cursor: Optional[sqlite3.Cursor] = None):
+        """Insert default packages into the database
+
+        When called with a cursor the inserts join the caller's transaction;
+        otherwise a pooled connection is borrowed and committed here.
+        """
+        if cursor is None:
+            with self._get_conn() as conn:
+                self.insert_default_packages(conn.cursor())
+                conn.commit()
+            return
+
         # Check if packages already exist
         cursor.execute("SELECT COUNT(*) FROM packages")
         if cursor.fetchone()[0] > 0:
-            conn.close()
             return
-        
+
         # Daily packages
         daily_packages = [
             ("24 Hrs Unlimited", "24 hours unlimited internet", 100.00, 24, None, None, "daily"),
@@ -117,14 +361,14 @@ class Database:
             ("6 Hrs Unlimited", "6 hours unlimited internet", 30.00, 6, None, None, "daily"),
             ("1 Hr Unlimited", "1 hour unlimited internet", 20.00, 1, None, None, "daily")
         ]
-        
+
         # Weekly packages
         weekly_packages = [
             ("10 GB", "10 GB data for 7 days", 150.00, 168, 10, None, "weekly"),
             ("20 GB", "20 GB data for 7 days", 250.00, 168, 20, None, "weekly"),
             ("40 GB", "40 GB data for 7 days", 450.00, 168, 40, None, "weekly")
         ]
-        
+
         # Monthly packages
         monthly_packages = [
             ("1 Mbps", "1 Mbps unlimited for 30 days", 300.00, 720, None, 1, "monthly"),
@@ -133,337 +377,463 @@ class Database:
             ("10 Mbps", "10 Mbps unlimited for 30 days", 1500.00, 720, None, 10, "monthly"),
             ("20 Mbps", "20 Mbps unlimited for 30 days", 2500.00, 720, None, 20, "monthly")
         ]
-        
+
         all_packages = daily_packages + weekly_packages + monthly_packages
-        
+
         cursor.executemany('''
             INSERT INTO packages (name, description, price, duration_hours, data_limit_gb, speed_limit_mbps, package_type)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', all_packages)
-        
-        conn.commit()
-        conn.close()
-    
+
+        self.invalidate_package_cache()
+
     # MAC Authentication Methods
-    
+
     def create_mac_user(self, mac_address: str, phone_number: str, email: str = None) -> Dict:
         """Create a new user with MAC address authentication"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            try:
+                cursor.execute('''
+                    INSERT INTO users (mac_address, phone_number, email)
+                    VALUES (?, ?, ?)
+                    RETURNING id, created_at
+                ''', (mac_address, phone_number, email))
+
+                row = cursor.fetchone()
+                conn.commit()
+
+                return {
+                    'id': row['id'],
+                    'mac_address': mac_address,
+                    'phone_number': phone_number,
+                    'email': email,
+                    'created_at': row['created_at']
+                }
+            except sqlite3.IntegrityError:
+                raise ValueError("MAC address already exists")
+
+    def upsert_mac_user(self, mac_address: str, phone_number: str, email: str = None) -> Dict:
+        """Get or create a MAC user in one statement, stamping last_login on repeat visits"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
             cursor.execute('''
                 INSERT INTO users (mac_address, phone_number, email)
                 VALUES (?, ?, ?)
+                ON CONFLICT(mac_address) DO UPDATE SET
+                    last_login = CURRENT_TIMESTAMP
+                RETURNING id, mac_address, phone_number, email, created_at, last_login,
+                          is_active, current_package_id, package_expires_at
             ''', (mac_address, phone_number, email))
-            
-            user_id = cursor.lastrowid
+
+            row = cursor.fetchone()
             conn.commit()
-            
-            return {
-                'id': user_id,
-                'mac_address': mac_address,
-                'phone_number': phone_number,
-                'email': email,
-                'created_at': datetime.datetime.now().isoformat()
-            }
-        except sqlite3.IntegrityError:
-            raise ValueError("MAC address already exists")
-        finally:
-            conn.close()
-    
+
+        return dict(row)
+
     def get_user_by_mac(self, mac_address: str) -> Optional[Dict]:
         """Get user by MAC address"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
-            FROM users WHERE mac_address = ?
-        ''', (mac_address,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT id, username, password, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
+                FROM users WHERE mac_address = ?
+            ''', (mac_address,))
+
+            row = cursor.fetchone()
+
         if row:
             return dict(row)
         return None
-    
-    def get_all_mac_users(self) -> List[Dict]:
+
+    def get_all_mac_users(self) -> List[sqlite3.Row]:
         """Get all MAC users"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
-            FROM users 
-            WHERE mac_address IS NOT NULL
-            ORDER BY created_at DESC
-        ''')
-        
-        users = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT id, username, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
+                FROM users
+                WHERE mac_address IS NOT NULL
+                ORDER BY created_at DESC
+            ''')
+
+            users = cursor.fetchall()
+
         return users
-    
+
     def delete_mac_user(self, mac_address: str):
         """Delete a MAC user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM users WHERE mac_address = ?', (mac_address,))
-        
-        if cursor.rowcount == 0:
-            raise ValueError("MAC address not found")
-        
-        conn.commit()
-        conn.close()
-    
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('DELETE FROM users WHERE mac_address = ?', (mac_address,))
+
+            if cursor.rowcount == 0:
+                raise ValueError("MAC address not found")
+
+            conn.commit()
+
     # Existing Methods (updated to support MAC authentication)
-    
+
     def create_user(self, username: str, password: str, phone_number: str, email: str = None) -> Dict:
         """Create a new user with username/password authentication"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Hash the password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO users (username, password, phone_number, email)
-                VALUES (?, ?, ?, ?)
-            ''', (username, hashed_password, phone_number, email))
-            
-            user_id = cursor.lastrowid
-            conn.commit()
-            
-            return {
-                'id': user_id,
-                'username': username,
-                'phone_number': phone_number,
-                'email': email,
-                'created_at': datetime.datetime.now().isoformat()
-            }
-        except sqlite3.IntegrityError:
-            raise ValueError("Username already exists")
-        finally:
-            conn.close()
-    
+        # Hash the password with a fresh per-user salt
+        salt = os.urandom(_SALT_BYTES)
+        hashed_password = _hash_password(password, salt)
+
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            try:
+                cursor.execute('''
+                    INSERT INTO users (username, password, password_salt, phone_number, email)
+                    VALUES (?, ?, ?, ?, ?)
+                    RETURNING id, created_at
+                ''', (username, hashed_password, salt.hex(), phone_number, email))
+
+                row = cursor.fetchone()
+                conn.commit()
+
+                return {
+                    'id': row['id'],
+                    'username': username,
+                    'phone_number': phone_number,
+                    'email': email,
+                    'created_at': row['created_at']
+                }
+            except sqlite3.IntegrityError:
+                raise ValueError("Username already exists")
+
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Get user by username"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
-            FROM users WHERE username = ?
-        ''', (username,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT id, username, password, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
+                FROM users WHERE username = ?
+            ''', (username,))
+
+            row = cursor.fetchone()
+
         if row:
             return dict(row)
         return None
-    
+
+    def verify_password(self, username: str, password: str) -> Optional[Dict]:
+        """Check a username/password pair, returning the user on success"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT id, password, password_salt FROM users WHERE username = ?
+            ''', (username,))
+
+            row = cursor.fetchone()
+
+        if not row or row['password'] is None:
+            return None
+
+        if row['password_salt']:
+            candidate = _hash_password(password, bytes.fromhex(row['password_salt']))
+        else:
+            # Accounts created before salted scrypt hashes were introduced
+            candidate = hashlib.sha256(password.encode()).hexdigest()
+
+        if not hmac.compare_digest(candidate, row['password']):
+            return None
+
+        if not row['password_salt']:
+            self._upgrade_legacy_password(row['id'], row['password'], password)
+        return self.get_user_by_id(row['id'])
+
+    def _upgrade_legacy_password(self, user_id: int, legacy_hash: str, password: str):
+        """Replace a verified unsalted sha256 hash with salted scrypt"""
+        salt = os.urandom(_SALT_BYTES)
+        hashed_password = _hash_password(password, salt)
+
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            # Only swap out the hash that was just verified, in case the
+            # password changed in the meantime
+            cursor.execute('''
+                UPDATE users SET password = ?, password_salt = ?
+                WHERE id = ? AND password = ? AND password_salt IS NULL
+            ''', (hashed_password, salt.hex(), user_id, legacy_hash))
+
+            conn.commit()
+
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
-            FROM users WHERE id = ?
-        ''', (user_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT id, username, password, phone_number, email, mac_address, created_at, last_login, is_active, current_package_id, package_expires_at
+                FROM users WHERE id = ?
+            ''', (user_id,))
+
+            row = cursor.fetchone()
+
         if row:
             return dict(row)
         return None
-    
-    def get_packages_by_type(self, package_type: str) -> List[Dict]:
+
+    def get_packages_by_type(self, package_type: str) -> List[sqlite3.Row]:
         """Get packages by type (daily, weekly, monthly)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, description, price, duration_hours, data_limit_gb, speed_limit_mbps, package_type
-            FROM packages 
-            WHERE package_type = ? AND is_active = 1
-            ORDER BY price ASC
-        ''', (package_type,))
-        
-        packages = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return packages
-    
-    def get_all_packages(self) -> List[Dict]:
+        def load():
+            with self._get_conn() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT id, name, description, price, duration_hours, data_limit_gb, speed_limit_mbps, package_type
+                    FROM packages
+                    WHERE package_type = ? AND is_active = 1
+                    ORDER BY price ASC
+                ''', (package_type,))
+
+                packages = cursor.fetchall()
+
+            return packages
+
+        return self._cached_packages(('type', package_type), load)
+
+    def get_all_packages(self) -> List[sqlite3.Row]:
         """Get all active packages"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, description, price, duration_hours, data_limit_gb, speed_limit_mbps, package_type
-            FROM packages 
-            WHERE is_active = 1
-            ORDER BY package_type, price ASC
-        ''')
-        
-        packages = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return packages
-    
+        def load():
+            with self._get_conn() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT id, name, description, price, duration_hours, data_limit_gb, speed_limit_mbps, package_type
+                    FROM packages
+                    WHERE is_active = 1
+                    ORDER BY package_type, price ASC
+                ''')
+
+                packages = cursor.fetchall()
+
+            return packages
+
+        return self._cached_packages(('all',), load)
+
     def get_package_by_id(self, package_id: int) -> Optional[Dict]:
         """Get package by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, description, price, duration_hours, data_limit_gb, speed_limit_mbps, package_type
-            FROM packages WHERE id = ? AND is_active = 1
-        ''', (package_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return dict(row)
-        return None
-    
-    def create_transaction(self, user_id: int, package_id: int, amount: float, 
+        def load():
+            with self._get_conn() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    SELECT id, name, description, price, duration_hours, data_limit_gb, speed_limit_mbps, package_type
+                    FROM packages WHERE id = ? AND is_active = 1
+                ''', (package_id,))
+
+                row = cursor.fetchone()
+
+            if row:
+                return dict(row)
+            return None
+
+        return self._cached_packages(('id', package_id), load)
+
+    def create_transaction(self, user_id: int, package_id: int, amount: float,
                           payment_method: str, phone_number: str, transaction_id: str = None) -> Dict:
         """Create a new transaction"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO transactions (user_id, package_id, amount, payment_method, phone_number, transaction_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, package_id, amount, payment_method, phone_number, transaction_id))
-        
-        transaction_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_INSERT_TRANSACTION_RETURNING_SQL,
+                           (user_id, package_id, amount, payment_method, phone_number, transaction_id))
+
+            row = cursor.fetchone()
+            conn.commit()
+
         return {
-            'id': transaction_id,
+            'id': row['id'],
             'user_id': user_id,
             'package_id': package_id,
             'amount': amount,
             'payment_method': payment_method,
             'phone_number': phone_number,
             'status': 'pending',
-            'created_at': datetime.datetime.now().isoformat()
+            'created_at': row['created_at']
         }
-    
+
+    def create_transactions(self, transactions: List[Dict]) -> int:
+        """Insert many pending transactions in one statement batch and commit"""
+        params = [
+            (t['user_id'], t['package_id'], t['amount'], t['payment_method'],
+             t['phone_number'], t.get('transaction_id'))
+            for t in transactions
+        ]
+
+        with self._get_conn() as conn:
+            conn.executemany(_INSERT_TRANSACTION_SQL, params)
+            conn.commit()
+
+        return len(params)
+
+    def get_transaction_by_checkout_id(self, checkout_request_id: str) -> Optional[Dict]:
+        """Get a transaction by the M-Pesa CheckoutRequestID stored in transaction_id"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT id, user_id, package_id, amount, payment_method, transaction_id, status, phone_number, created_at, completed_at
+                FROM transactions WHERE transaction_id = ?
+            ''', (checkout_request_id,))
+
+            row = cursor.fetchone()
+
+        if row:
+            return dict(row)
+        return None
+
     def update_transaction_status(self, transaction_id: int, status: str):
         """Update transaction status"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        completed_at = datetime.datetime.now() if status == 'completed' else None
-        
-        cursor.execute('''
-            UPDATE transactions 
-            SET status = ?, completed_at = ?
-            WHERE id = ?
-        ''', (status, completed_at, transaction_id))
-        
-        conn.commit()
-        conn.close()
-    
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_UPDATE_TRANSACTION_STATUS_SQL, (status, transaction_id))
+
+            conn.commit()
+
+    def create_payment_request(self, tracking_id: str) -> int:
+        """Record a pending background STK push and return its id"""
+        with self._get_conn() as conn:
+            cursor = conn.execute('INSERT INTO payment_requests (tracking_id) VALUES (?)', (tracking_id,))
+            conn.commit()
+        return cursor.lastrowid
+
+    def finish_payment_request(self, tracking_id: str, status: str, checkout_request_id: str = None,
+                               customer_message: str = None, error: str = None):
+        """Store the outcome of a background STK push"""
+        with self._get_conn() as conn:
+            conn.execute('''
+                UPDATE payment_requests
+                SET status = ?, checkout_request_id = ?, customer_message = ?, error = ?
+                WHERE tracking_id = ?
+            ''', (status, checkout_request_id, customer_message, error, tracking_id))
+            conn.commit()
+
+    def get_payment_request(self, tracking_id: str) -> Optional[Dict]:
+        """Get a background STK push by tracking id"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT tracking_id, status, checkout_request_id, customer_message, error, created_at
+                FROM payment_requests WHERE tracking_id = ?
+            ''', (tracking_id,))
+
+            row = cursor.fetchone()
+
+        if row:
+            return dict(row)
+        return None
+
     def assign_package_to_user(self, user_id: int, package_id: int):
         """Assign a package to a user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Get package details
-        package = self.get_package_by_id(package_id)
-        if not package:
-            raise ValueError("Package not found")
-        
-        # Calculate expiration time
-        expires_at = datetime.datetime.now() + datetime.timedelta(hours=package['duration_hours'])
-        
-        cursor.execute('''
-            UPDATE users 
-            SET current_package_id = ?, package_expires_at = ?
-            WHERE id = ?
-        ''', (package_id, expires_at, user_id))
-        
-        conn.commit()
-        conn.close()
-    
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_ASSIGN_PACKAGE_SQL, (package_id, package_id, user_id, package_id))
+
+            if cursor.rowcount == 0:
+                raise ValueError("Package or user not found")
+
+            conn.commit()
+
+    def complete_payment(self, transaction_id: int, user_id: int, package_id: int):
+        """Settle a paid transaction: mark it completed and activate the package atomically"""
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+
+            cursor.execute(_UPDATE_TRANSACTION_STATUS_SQL, ('completed', transaction_id))
+            if cursor.rowcount == 0:
+                raise ValueError("Transaction not found")
+
+            cursor.execute(_ASSIGN_PACKAGE_SQL, (package_id, package_id, user_id, package_id))
+            if cursor.rowcount == 0:
+                raise ValueError("Package or user not found")
+
+            cursor.execute(_UPDATE_LAST_LOGIN_SQL, (user_id,))
+
+            conn.commit()
+
     def update_last_login(self, user_id: int):
         """Update user's last login time"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE users 
-            SET last_login = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_user_transactions(self, user_id: int) -> List[Dict]:
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_UPDATE_LAST_LOGIN_SQL, (user_id,))
+
+            conn.commit()
+
+    def get_user_transactions(self, user_id: int) -> List[sqlite3.Row]:
         """Get all transactions for a user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT t.id, t.amount, t.payment_method, t.status, t.created_at, t.completed_at,
-                   p.name as package_name, p.description as package_description
-            FROM transactions t
-            JOIN packages p ON t.package_id = p.id
-            WHERE t.user_id = ?
-            ORDER BY t.created_at DESC
-        ''', (user_id,))
-        
-        transactions = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT t.id, t.amount, t.payment_method, t.status, t.created_at, t.completed_at,
+                       p.name as package_name, p.description as package_description
+                FROM transactions t
+                JOIN packages p ON t.package_id = p.id
+                WHERE t.user_id = ?
+                ORDER BY t.created_at DESC
+            ''', (user_id,))
+
+            transactions = cursor.fetchall()
+
         return transactions
-    
+
     def check_user_package_status(self, user_id: int) -> Dict:
         """Check if user has an active package"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.current_package_id, u.package_expires_at,
-                   p.name as package_name, p.description as package_description
-            FROM users u
-            LEFT JOIN packages p ON u.current_package_id = p.id
-            WHERE u.id = ?
-        ''', (user_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
+        with self._get_conn() as conn:
+            cursor = conn.cursor()
+
+            # package_expires_at is stored as UTC 'YYYY-MM-DD HH:MM:SS', so a
+            # text comparison against datetime('now') is chronological
+            cursor.execute('''
+                SELECT u.current_package_id, u.package_expires_at,
+                       p.name as package_name, p.description as package_description,
+                       COALESCE(u.current_package_id IS NOT NULL
+                                AND u.package_expires_at > datetime('now'), 0) as has_active_package
+                FROM users u
+                LEFT JOIN packages p ON u.current_package_id = p.id
+                WHERE u.id = ?
+            ''', (user_id,))
+
+            row = cursor.fetchone()
+
         if not row:
             return {'has_active_package': False}
-        
-        has_active_package = (
-            row['current_package_id'] is not None and 
-            row['package_expires_at'] is not None and
-            datetime.datetime.fromisoformat(row['package_expires_at']) > datetime.datetime.now()
-        )
-        
+
         return {
-            'has_active_package': has_active_package,
+            'has_active_package': bool(row['has_active_package']),
             'package_id': row['current_package_id'],
             'package_name': row['package_name'],
             'package_description': row['package_description'],
             'expires_at': row['package_expires_at']
         }
 
-# Create a global database instance
-db = Database() 
\ No newline at end of file
+_db = None
+_db_lock = threading.Lock()
+
+def get_db() -> Database:
+    """Return the process-wide Database, creating it on first use"""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                from config import get_config
+                # At least one connection per Gunicorn thread so requests never wait on the pool
+                _db = Database(pool_size=get_config().DB_POOL_SIZE)
+    return _db
\ No newline at end of file
@@ -29,15 +29,23 @@ MIKROTIK_PASSWORD=your-mikrotik-password
 MIKROTIK_PORT=8728
 MIKROTIK_USE_SSL=False
 MIKROTIK_SSL_VERIFY=False
+MIKROTIK_POOL_SIZE=8
 
 # M-Pesa Daraja API settings
 MPESA_CONSUMER_KEY=your-consumer-key
 MPESA_CONSUMER_SECRET=your-consumer-secret
 MPESA_PAYBILL=your-paybill-number
+MPESA_PASSKEY=your-passkey
 MPESA_ENVIRONMENT=production
+MPESA_CALLBACK_URL=https://your-domain.com/api/mpesa-callback
+MPESA_CALLBACK_TOKEN=long-random-string
 
 # Database settings
 DATABASE_URL=sqlite:///hotspot.db
+DB_POOL_SIZE=10
+
+# Shared cache for multiple Gunicorn workers (optional, e.g. redis://localhost:6379/0)
+REDIS_URL=
 
 # Server settings
 HOST=0.0.0.0
@@ -93,8 +101,9 @@ source venv/bin/activate
 # Set production environment
 export FLASK_ENV=production
 
-# Start the application with Gunicorn
-gunicorn -w 4 -b 0.0.0.0:5000 --timeout 120 --keep-alive 2 flask_api_endpoints:app
+# Start the application with Gunicorn (threaded workers so slow SQLite,
+# M-Pesa or RouterOS calls don't block the whole worker)
+gunicorn -k gthread --workers $(nproc) --threads 8 --worker-connections 1000 -b 0.0.0.0:5000 --timeout 120 --keep-alive 5 flask_api_endpoints:app
 """
     
     with open('start_production.sh', 'w') as f:
@@ -116,7 +125,7 @@ Type=simple
 User=www-data
 WorkingDirectory=/path/to/your/fortunet
 Environment=PATH=/path/to/your/fortunet/venv/bin
-ExecStart=/path/to/your/fortunet/venv/bin/gunicorn -w 4 -b 0.0.0.0:5000 flask_api_endpoints:app
+ExecStart=/path/to/your/fortunet/venv/bin/gunicorn -k gthread -w 4 --threads 8 --worker-connections 1000 -b 0.0.0.0:5000 --timeout 120 --keep-alive 5 flask_api_endpoints:app
 Restart=always
 RestartSec=10
 
@@ -130,6 +139,39 @@ WantedBy=multi-user.target
     print("✅ Created systemd service file: fortunet.service")
     print("⚠️  Update the paths in fortunet.service before using!")
 
+def create_housekeeping_timer():
+    """Create systemd timer that runs daily database housekeeping"""
+    service_content = """[Unit]
+Description=FortuNet database housekeeping
+
+[Service]
+Type=oneshot
+User=www-data
+WorkingDirectory=/path/to/your/fortunet
+ExecStart=/path/to/your/fortunet/venv/bin/python -c "from database import get_db; get_db().housekeeping()"
+"""
+    
+    timer_content = """[Unit]
+Description=Run FortuNet database housekeeping daily
+
+[Timer]
+OnCalendar=daily
+RandomizedDelaySec=1h
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+"""
+    
+    with open('fortunet-housekeeping.service', 'w') as f:
+        f.write(service_content)
+    
+    with open('fortunet-housekeeping.timer', 'w') as f:
+        f.write(timer_content)
+    
+    print("✅ Created housekeeping timer: fortunet-housekeeping.service, fortunet-housekeeping.timer")
+    print("⚠️  Update the paths in fortunet-housekeeping.service before using!")
+
 def create_nginx_config():
     """Create Nginx configuration for production"""
     nginx_config = """server {
@@ -209,6 +251,7 @@ def main():
     # Create production scripts
     create_production_script()
     create_systemd_service()
+    create_housekeeping_timer()
     create_nginx_config()
     
     print("\n🎉 Deployment preparation completed!")
@@ -220,6 +263,8 @@ def main():
     print("5. Enable the site: sudo ln -s /etc/nginx/sites-available/fortunet /etc/nginx/sites-enabled/")
     print("6. Copy fortunet.service to /etc/systemd/system/")
     print("7. Enable and start the service: sudo systemctl enable fortunet && sudo systemctl start fortunet")
+    print("8. Copy fortunet-housekeeping.service and fortunet-housekeeping.timer to /etc/systemd/system/")
+    print("9. Enable the timer: sudo systemctl enable --now fortunet-housekeeping.timer")
     print("\n🔒 Security reminder: Change default passwords and use strong secrets!")
 
 if __name__ == "__main__":
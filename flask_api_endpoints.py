@@ -35,25 +35,37 @@ M-Pesa Daraja Payment Flow:
 API Endpoints:
 """
 
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, current_app, jsonify, request
 from flask_cors import CORS
-import hashlib
 import datetime
-import re
-import requests
+import hmac
 import json
-import random
-import routeros_api
-from database import db
-from mpesa_stkpush import process_payment
+import os
+import queue
+import select
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from database import get_db
+from flask_helpers import ORJSONProvider, etagged
 from config import get_config
 
-app = Flask(__name__)
-CORS(app)
+try:
+    import redis
+except ImportError:  # caches stay per-process
+    redis = None
+
+# routeros_api, requests and mpesa_stkpush are imported inside the functions
+# that use them so Gunicorn workers boot without loading them
+
+# Routes are collected on a blueprint and attached to the app in create_app()
+api_bp = Blueprint('api', __name__)
 
 # Load configuration
 config = get_config()
-app.config.from_object(config)
 
 # MikroTik settings from configuration
 MIKROTIK_IP = config.MIKROTIK_IP
@@ -62,28 +74,44 @@ PASSWORD = config.MIKROTIK_PASSWORD
 MIKROTIK_PORT = config.MIKROTIK_PORT
 MIKROTIK_USE_SSL = config.MIKROTIK_USE_SSL
 MIKROTIK_SSL_VERIFY = config.MIKROTIK_SSL_VERIFY
+MIKROTIK_POOL_SIZE = config.MIKROTIK_POOL_SIZE
+
+# Token Daraja sends back on payment callbacks (see mpesa_stkpush.process_payment)
+MPESA_CALLBACK_TOKEN = config.MPESA_CALLBACK_TOKEN
 
-# M-Pesa settings
-MPESA_CONSUMER_KEY = 'your_consumer_key'
-MPESA_CONSUMER_SECRET = 'your_consumer_secret'
-MPESA_PAYBILL = '123456'
-MPESA_ENVIRONMENT = 'sandbox'  # or 'production'
+# Optional Redis shared by all Gunicorn workers for the RouterOS caches
+REDIS_URL = config.REDIS_URL
+_redis = redis.Redis.from_url(REDIS_URL) if redis is not None and REDIS_URL else None
 
+# scrypt releases the GIL, so password hashing runs in parallel here instead
+# of tying up the request thread for the whole derivation
+HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='pwhash')
+
+# STK pushes wait on Safaricom for seconds; run them off the request thread
+PAYMENT_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='stkpush')
 
 
 # ============================================================================
-# USER SESSION ENDPOINTS
+# MIKROTIK CONNECTION
 # ============================================================================
 
-@app.route('/api/current-session', methods=['GET'])
-def get_current_session():
-    """Get current user session data from MikroTik"""
-    try:
-        # Get client IP from request
-        client_ip = request.remote_addr
-        
-        # Connect to MikroTik
-        connection = routeros_api.RouterOsApiPool(
+class _RouterOsPool:
+    """Fixed-size pool of RouterOS connections checked out one request at a time
+
+    A RouterOS API socket can't carry interleaved commands, so each request
+    thread gets exclusive use of a connection until it hands it back. Slots
+    start empty and are connected on first checkout; the login is then reused
+    for the worker's lifetime.
+    """
+
+    def __init__(self, size):
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(None)
+
+    def _connect(self):
+        import routeros_api
+        return routeros_api.RouterOsApiPool(
             host=MIKROTIK_IP,
             username=USERNAME,
             password=PASSWORD,
@@ -92,97 +120,434 @@ def get_current_session():
             ssl_verify=MIKROTIK_SSL_VERIFY,
             plaintext_login=not MIKROTIK_USE_SSL
         )
-        api = connection.get_api()
-        
-        # Get active session for this IP
-        active_sessions = api.get_resource('/ip/hotspot/active').get()
-        
-        for session in active_sessions:
-            if session.get('address') == client_ip:
-                return jsonify({
-                    'username': session.get('user', 'Guest'),
-                    'address': session.get('address'),
-                    'mac-address': session.get('mac-address'),
-                    'bytes-in': session.get('bytes-in', 0),
-                    'bytes-out': session.get('bytes-out', 0),
-                    'uptime': session.get('uptime'),
-                    'idle-time': session.get('idle-time'),
-                    'session-time-left': session.get('session-time-left'),
-                    'profile': session.get('profile'),
-                    'rate-limit': session.get('rate-limit'),
-                    'limit-uptime': session.get('limit-uptime')
-                })
+
+    @staticmethod
+    def _is_stale(connection):
+        """Whether the router closed an idle connection's socket
+
+        Nothing should be waiting on an idle API socket, so a readable one
+        has hit EOF (or carries a !fatal) and would fail the next command.
+        """
+        sock = getattr(connection.socket, 'socket', None)
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def acquire(self):
+        """Check out a connection, waiting if all of them are in use"""
+        connection = self._idle.get()
+        if connection is not None and connection.connected and self._is_stale(connection):
+            # get_api() in mikrotik_api() then logs in on a fresh socket
+            connection.disconnect()
+        if connection is None:
+            try:
+                connection = self._connect()
+            except Exception:
+                self._idle.put(None)
+                raise
+        return connection
+
+    def release(self, connection):
+        """Hand a connection back to the pool"""
+        self._idle.put(connection)
+
+_ros_pool = _RouterOsPool(MIKROTIK_POOL_SIZE)
+
+def _is_connection_error(error):
+    """Whether error means the RouterOS socket itself is unusable"""
+    from routeros_api.exceptions import RouterOsApiConnectionError
+    return isinstance(error, (RouterOsApiConnectionError, OSError))
+
+@contextmanager
+def mikrotik_api():
+    """Yield the API handle of a pooled RouterOS connection"""
+    connection = _ros_pool.acquire()
+    try:
+        yield connection.get_api()
+    except Exception as e:
+        if _is_connection_error(e):
+            # Drop the dead socket; get_api() logs in again on next checkout
+            try:
+                connection.disconnect()
+            except Exception:
+                pass
+        raise
+    finally:
+        _ros_pool.release(connection)
+
+def _redis_cached(key, seconds, loader):
+    """Read key from Redis, or run loader() and store its result for seconds
+
+    A SET NX lock makes one worker do the load while the others poll for
+    the value. Returns (value, seconds left); any Redis failure falls back
+    to calling loader() directly.
+    """
+    locked = False
+    try:
+        deadline = time.monotonic() + 5
+        while True:
+            with _redis.pipeline() as pipe:
+                blob, ttl_ms = pipe.get(key).pttl(key).execute()
+            if blob is not None and ttl_ms > 0:
+                return json.loads(blob), ttl_ms / 1000.0
+            locked = bool(_redis.set(f'{key}:lock', b'1', nx=True, px=5000))
+            if locked or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+    except redis.RedisError:
+        return loader(), seconds
+    
+    try:
+        value = loader()
+        try:
+            _redis.set(key, json.dumps(value), px=int(seconds * 1000))
+        except redis.RedisError:
+            pass
+        return value, seconds
+    finally:
+        if locked:
+            try:
+                _redis.delete(f'{key}:lock')
+            except redis.RedisError:
+                pass
+
+def ttl_cache(seconds, shared_key=None):
+    """Cache a function's result per argument tuple for the given number of seconds
+
+    Concurrent misses on the same key are single-flighted: one caller runs
+    the function while the rest wait for its result. With shared_key set and
+    REDIS_URL configured, misses are also shared between worker processes.
+    cache_clear() also discards results of calls already in flight.
+    """
+    def decorator(func):
+        entries = {}
+        inflight = {}
+        lock = threading.Lock()
+        # Bumped by cache_clear() so loads that started before it aren't stored
+        generation = 0
+
+        def redis_key(args):
+            return ':'.join([shared_key, *map(str, args)])
+
+        def load(args):
+            if _redis is None or shared_key is None:
+                return func(*args), seconds
+            return _redis_cached(redis_key(args), seconds, lambda: func(*args))
+
+        @wraps(func)
+        def wrapper(*args):
+            while True:
+                with lock:
+                    hit = entries.get(args)
+                    if hit is not None and hit[0] > time.monotonic():
+                        return hit[1]
+                    flight = inflight.get(args)
+                    leader = flight is None
+                    if leader:
+                        flight = inflight[args] = threading.Event()
+                        started = generation
+                if leader:
+                    break
+                # Re-check the cache once the leader is done; if its call
+                # failed, one of the waiters takes over
+                flight.wait()
+            
+            try:
+                value, ttl = load(args)
+                with lock:
+                    stale = started != generation
+                    if not stale:
+                        entries[args] = (time.monotonic() + ttl, value)
+                if stale:
+                    # Undo the shared copy too; cache_clear() ran mid-load
+                    delete_shared(args)
+                return value
+            finally:
+                with lock:
+                    del inflight[args]
+                flight.set()
+
+        def delete_shared(*keys):
+            if _redis is not None and shared_key is not None:
+                try:
+                    _redis.delete(*(redis_key(args) for args in keys), shared_key)
+                except redis.RedisError:
+                    pass
+
+        def cache_clear():
+            nonlocal generation
+            with lock:
+                generation += 1
+                delete_shared(*entries, *inflight)
+                entries.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+# The dashboard polls every few seconds; a 2s TTL on active sessions keeps the
+# data fresh for each client while collapsing concurrent polls into one RPC
+@ttl_cache(seconds=2, shared_key='mikrotik:active')
+def fetch_active():
+    """Get the hotspot active-session list"""
+    with mikrotik_api() as api:
+        return api.get_resource('/ip/hotspot/active').get()
+
+@ttl_cache(seconds=60, shared_key='mikrotik:users:count')
+def count_hotspot_users():
+    """Count configured hotspot users without transferring the user list"""
+    with mikrotik_api() as api:
+        response = api.get_binary_resource('/ip/hotspot/user').call('print', {'count-only': b''})
+    return int(response.done_message.get('ret', b'0'))
+
+class _AdminBatcher:
+    """Coalesce disconnect/block operations into one RouterOS pipeline
+
+    Operations submitted within max_wait_ms of each other (up to
+    max_batch_size) are sent back-to-back on a single pooled connection by a
+    background thread; each caller gets a Future for its own result.
+    """
+
+    def __init__(self, max_batch_size=16, max_wait_ms=10):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, op, user_id):
+        """Queue op ('disconnect' or 'block') for user_id and return its Future"""
+        future = Future()
+        self._pending.put((op, user_id, future))
+        with self._lock:
+            # Started on first use so each Gunicorn worker runs its own drainer
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ros-batcher', daemon=True)
+                self._thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            with mikrotik_api() as api:
+                self._send(api, batch)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        fetch_active.cache_clear()
+
+    def _send(self, api, batch):
+        active = api.get_resource('/ip/hotspot/active')
+        address_list = api.get_resource('/ip/firewall/address-list')
+        
+        # Look up every session being blocked in one round-trip; a bad op
+        # only fails its own Future, not the rest of the batch
+        queued = []
+        for op, user_id, future in batch:
+            try:
+                lookup = active.get_async(**{'.id': user_id}) if op == 'block' else None
+            except Exception as e:
+                if _is_connection_error(e):
+                    raise
+                future.set_exception(e)
+                continue
+            queued.append((user_id, future, lookup))
+        
+        # Queue all the writes, then read their replies in a second round-trip
+        writes = []
+        for user_id, future, lookup in queued:
+            try:
+                promises = []
+                if lookup is not None:
+                    rows = lookup.get()
+                    if not rows:
+                        future.set_result(False)
+                        continue
+                    user = rows[0]
+                    promises.append(address_list.add_async(
+                        address=user.get('address'),
+                        list='blocked_users',
+                        comment=f'Blocked user: {user.get("user")}'
+                    ))
+                promises.append(active.remove_async(id=user_id))
+                writes.append((future, promises))
+            except Exception as e:
+                if _is_connection_error(e):
+                    raise
+                future.set_exception(e)
+        
+        for future, promises in writes:
+            error = None
+            for promise in promises:
+                try:
+                    promise.get()
+                except Exception as e:
+                    if _is_connection_error(e):
+                        raise
+                    error = error or e
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(True)
+
+_admin_batcher = _AdminBatcher()
+
+# ============================================================================
+# USER SESSION ENDPOINTS
+# ============================================================================
+
+@api_bp.route('/api/current-session', methods=['GET'])
+def get_current_session():
+    """Get current user session data from MikroTik"""
+    try:
+        # Get client IP from request
+        client_ip = request.remote_addr
+        
+        # Get active session for this IP; RouterOS does the matching
+        with mikrotik_api() as api:
+            rows = api.get_resource('/ip/hotspot/active').get(address=client_ip)
+        
+        if rows:
+            session = rows[0]
+            return jsonify({
+                'username': session.get('user', 'Guest'),
+                'address': session.get('address'),
+                'mac-address': session.get('mac-address'),
+                'bytes-in': session.get('bytes-in', 0),
+                'bytes-out': session.get('bytes-out', 0),
+                'uptime': session.get('uptime'),
+                'idle-time': session.get('idle-time'),
+                'session-time-left': session.get('session-time-left'),
+                'profile': session.get('profile'),
+                'rate-limit': session.get('rate-limit'),
+                'limit-uptime': session.get('limit-uptime')
+            })
         
         return jsonify({'error': 'No active session found'}), 404
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/api/register', methods=['POST'])
+def register():
+    """Create a username/password account"""
+    try:
+        data = request.get_json()
+        
+        # Validate required fields
+        required_fields = ['username', 'password', 'phoneNumber']
+        for field in required_fields:
+            if not data.get(field):
+                return jsonify({'error': f'Missing required field: {field}'}), 400
+        
+        future = HASH_POOL.submit(
+            get_db().create_user,
+            data['username'],
+            data['password'],
+            data['phoneNumber'],
+            data.get('email')
+        )
+        user = future.result()
+        
+        return jsonify(user), 201
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/api/login', methods=['POST'])
+def login():
+    """Authenticate a username/password account"""
+    try:
+        data = request.get_json()
+        
+        if not data.get('username') or not data.get('password'):
+            return jsonify({'error': 'Username and password are required'}), 400
+        
+        db = get_db()
+        future = HASH_POOL.submit(db.verify_password, data['username'], data['password'])
+        user = future.result()
+        
+        if not user:
+            return jsonify({'error': 'Invalid username or password'}), 401
+        
+        db.update_last_login(user['id'])
+        user.pop('password', None)
+        
+        return jsonify(user)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============================================================================
 # ADMIN DASHBOARD ENDPOINTS
 # ============================================================================
 
-@app.route('/api/active-users', methods=['GET'])
+def _as_int(value):
+    """Convert a RouterOS counter, passing through values that are already ints"""
+    return value if type(value) is int else int(value)
+
+@api_bp.route('/api/active-users', methods=['GET'])
+@etagged
 def get_active_users():
     """Get all active users from MikroTik"""
     try:
-        connection = routeros_api.RouterOsApiPool(
-            host=MIKROTIK_IP,
-            username=USERNAME,
-            password=PASSWORD,
-            port=MIKROTIK_PORT,
-            use_ssl=MIKROTIK_USE_SSL,
-            ssl_verify=MIKROTIK_SSL_VERIFY,
-            plaintext_login=not MIKROTIK_USE_SSL
-        )
-        api = connection.get_api()
-        
-        active_users = api.get_resource('/ip/hotspot/active').get()
+        active_users = fetch_active()
         
         # Transform data for frontend
-        users = []
-        for user in active_users:
-            users.append({
+        now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        users = [
+            {
                 'id': user.get('.id'),
                 'username': user.get('user', 'Unknown'),
                 'mac': user.get('mac-address', 'N/A'),
                 'ip': user.get('address', 'N/A'),
                 'uptime': user.get('uptime', '0h 0m'),
                 'idleTime': user.get('idle-time', '0m'),
-                'bytesIn': int(user.get('bytes-in', 0)),
-                'bytesOut': int(user.get('bytes-out', 0)),
+                'bytesIn': _as_int(user.get('bytes-in', 0)),
+                'bytesOut': _as_int(user.get('bytes-out', 0)),
                 'plan': user.get('profile', 'Default'),
                 'status': 'active',
-                'lastSeen': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            })
+                'lastSeen': now_str
+            }
+            for user in active_users
+        ]
         
         return jsonify(users)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/stats', methods=['GET'])
+@api_bp.route('/api/stats', methods=['GET'])
+@etagged
 def get_system_stats():
     """Get system statistics"""
     try:
         # Get active users count
-        connection = routeros_api.RouterOsApiPool(
-            host=MIKROTIK_IP,
-            username=USERNAME,
-            password=PASSWORD,
-            port=MIKROTIK_PORT,
-            use_ssl=MIKROTIK_USE_SSL,
-            ssl_verify=MIKROTIK_SSL_VERIFY,
-            plaintext_login=not MIKROTIK_USE_SSL
-        )
-        api = connection.get_api()
-        
-        active_users = api.get_resource('/ip/hotspot/active').get()
+        active_users = fetch_active()
         active_count = len(active_users)
         
         # Get total users from hotspot users
-        total_users = api.get_resource('/ip/hotspot/user').get()
-        total_users_count = len(total_users)
+        total_users_count = count_hotspot_users()
         
         # Calculate total revenue (this should come from database in production)
         total_revenue = 1500  # Placeholder
@@ -211,84 +576,98 @@ def get_system_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/disconnect-user/<user_id>', methods=['POST'])
+@api_bp.route('/api/disconnect-user/<user_id>', methods=['POST'])
 def disconnect_user(user_id):
     """Disconnect a user from MikroTik"""
     try:
-        connection = routeros_api.RouterOsApiPool(
-            host=MIKROTIK_IP,
-            username=USERNAME,
-            password=PASSWORD,
-            port=MIKROTIK_PORT,
-            use_ssl=MIKROTIK_USE_SSL,
-            ssl_verify=MIKROTIK_SSL_VERIFY,
-            plaintext_login=not MIKROTIK_USE_SSL
-        )
-        api = connection.get_api()
-        
         # Remove user from active sessions
-        api.get_resource('/ip/hotspot/active').remove(id=user_id)
+        _admin_batcher.submit('disconnect', user_id).result()
         
         return jsonify({'message': 'User disconnected successfully'})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/block-user/<user_id>', methods=['POST'])
+@api_bp.route('/api/block-user/<user_id>', methods=['POST'])
 def block_user(user_id):
     """Block a user in MikroTik"""
     try:
-        connection = routeros_api.RouterOsApiPool(
-            host=MIKROTIK_IP,
-            username=USERNAME,
-            password=PASSWORD,
-            port=8728,
-            plaintext_login=True
-        )
-        api = connection.get_api()
-        
-        # Get user details
-        active_users = api.get_resource('/ip/hotspot/active').get()
-        user = None
-        for u in active_users:
-            if u.get('.id') == user_id:
-                user = u
-                break
-        
-        if user:
-            # Add user to address list for blocking
-            api.get_resource('/ip/firewall/address-list').add(
-                address=user.get('address'),
-                list='blocked_users',
-                comment=f'Blocked user: {user.get("user")}'
-            )
-            
-            # Disconnect user
-            api.get_resource('/ip/hotspot/active').remove(id=user_id)
+        # Add user to the blocked address list and disconnect them
+        _admin_batcher.submit('block', user_id).result()
         
         return jsonify({'message': 'User blocked successfully'})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/api/disconnect-users', methods=['POST'])
+def disconnect_users():
+    """Disconnect several users from MikroTik"""
+    try:
+        ids = request.get_json().get('ids')
+        if not isinstance(ids, list) or not all(isinstance(user_id, str) for user_id in ids):
+            return jsonify({'error': 'ids must be a list of strings'}), 400
+        
+        futures = [(user_id, _admin_batcher.submit('disconnect', user_id)) for user_id in ids]
+        
+        disconnected = []
+        failed = {}
+        for user_id, future in futures:
+            try:
+                future.result()
+                disconnected.append(user_id)
+            except Exception as e:
+                failed[user_id] = str(e)
+        
+        return jsonify({'disconnected': disconnected, 'failed': failed})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/api/block-users', methods=['POST'])
+def block_users():
+    """Block several users in MikroTik"""
+    try:
+        ids = request.get_json().get('ids')
+        if not isinstance(ids, list) or not all(isinstance(user_id, str) for user_id in ids):
+            return jsonify({'error': 'ids must be a list of strings'}), 400
+        
+        futures = [(user_id, _admin_batcher.submit('block', user_id)) for user_id in ids]
+        
+        blocked = []
+        failed = {}
+        for user_id, future in futures:
+            try:
+                if future.result():
+                    blocked.append(user_id)
+            except Exception as e:
+                failed[user_id] = str(e)
+        
+        return jsonify({'blocked': blocked, 'failed': failed})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============================================================================
 # PACKAGE MANAGEMENT ENDPOINTS
 # ============================================================================
 
-@app.route('/api/packages', methods=['GET'])
+@api_bp.route('/api/packages', methods=['GET'])
+@etagged
 def get_packages():
     """Get all packages"""
     try:
-        packages = db.get_all_packages()
+        packages = get_db().get_all_packages()
         return jsonify({'packages': packages})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/packages', methods=['POST'])
+@api_bp.route('/api/packages', methods=['POST'])
 def create_package():
     """Create a new package"""
     try:
         data = request.get_json()
+        db = get_db()
         
         package = db.create_package(
             name=data['name'],
@@ -297,17 +676,19 @@ def create_package():
             validity=data['validity'],
             data_limit=data['dataLimit']
         )
+        db.invalidate_package_cache()
         
         return jsonify(package), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/packages/<int:package_id>', methods=['PUT'])
+@api_bp.route('/api/packages/<int:package_id>', methods=['PUT'])
 def update_package(package_id):
     """Update a package"""
     try:
         data = request.get_json()
+        db = get_db()
         
         package = db.update_package(
             package_id,
@@ -317,17 +698,20 @@ def update_package(package_id):
             validity=data['validity'],
             data_limit=data['dataLimit']
         )
+        db.invalidate_package_cache()
         
         return jsonify(package)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/packages/<int:package_id>', methods=['DELETE'])
+@api_bp.route('/api/packages/<int:package_id>', methods=['DELETE'])
 def delete_package(package_id):
     """Delete a package"""
     try:
+        db = get_db()
         db.delete_package(package_id)
+        db.invalidate_package_cache()
         return jsonify({'message': 'Package deleted successfully'})
         
     except Exception as e:
@@ -337,20 +721,21 @@ def delete_package(package_id):
 # TRANSACTION ENDPOINTS
 # ============================================================================
 
-@app.route('/api/transactions', methods=['GET'])
+@api_bp.route('/api/transactions', methods=['GET'])
+@etagged
 def get_transactions():
     """Get all transactions"""
     try:
-        transactions = db.get_all_transactions()
+        transactions = get_db().get_all_transactions()
         return jsonify({'transactions': transactions})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/transactions/<int:transaction_id>', methods=['GET'])
+@api_bp.route('/api/transactions/<int:transaction_id>', methods=['GET'])
 def get_transaction(transaction_id):
     """Get a specific transaction"""
     try:
-        transaction = db.get_transaction_by_id(transaction_id)
+        transaction = get_db().get_transaction_by_id(transaction_id)
         if transaction:
             return jsonify(transaction)
         else:
@@ -362,73 +747,133 @@ def get_transaction(transaction_id):
 # M-PESA PAYMENT ENDPOINTS
 # ============================================================================
 
-@app.route('/api/initiate-payment', methods=['POST'])
+# Required initiate-payment fields and the JSON types each may take
+_PAYMENT_FIELDS = (
+    ('phoneNumber', str),
+    ('packageId', int),
+    ('amount', (int, float)),
+    ('packageName', str),
+)
+
+def _validate_payment_request(data):
+    """Return an error message for a malformed initiate-payment body, else None"""
+    if not isinstance(data, dict):
+        return 'Request body must be a JSON object'
+    for field, types in _PAYMENT_FIELDS:
+        if field not in data:
+            return f'Missing required field: {field}'
+        value = data[field]
+        if not isinstance(value, types) or isinstance(value, bool):
+            return f'Invalid value for field: {field}'
+    return None
+
+@api_bp.route('/api/initiate-payment', methods=['POST'])
 def initiate_payment():
     """Initiate M-Pesa payment"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
         # Validate required fields
-        required_fields = ['phoneNumber', 'packageId', 'amount', 'packageName']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        error = _validate_payment_request(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Process payment using M-Pesa STK push
-        result = process_payment(
-            phone_number=data['phoneNumber'],
+        # Reject bad numbers now; only the Daraja round-trip is deferred
+        from mpesa_stkpush import normalize_phone_number
+        phone_number = normalize_phone_number(data['phoneNumber'])
+        if phone_number is None:
+            return jsonify({'error': 'Invalid phone number'}), 400
+        
+        # Send the STK push in the background; the client polls
+        # /api/payment-status/<trackingId> or waits for the callback
+        tracking_id = uuid.uuid4().hex
+        payment_id = get_db().create_payment_request(tracking_id)
+        PAYMENT_POOL.submit(
+            send_stk_push,
+            tracking_id,
+            phone_number=phone_number,
             amount=data['amount'],
             package_name=data['packageName'],
-            user_id=data.get('username', 'guest')
+            payment_id=payment_id
         )
         
-        if result['success']:
-            # Save transaction to database (implement your database logic here)
-            # transaction = db.create_transaction(...)
-            
-            return jsonify({
-                'success': True,
-                'checkoutRequestID': result.get('checkout_request_id'),
-                'customerMessage': result.get('customer_message'),
-                'message': 'STK push sent successfully'
-            })
-        else:
-            return jsonify({'error': result.get('error', 'Payment initiation failed')}), 400
+        # Not a success yet: the push may still fail, so clients poll for it
+        return jsonify({
+            'success': False,
+            'status': 'pending',
+            'trackingId': tracking_id,
+            'message': 'STK push queued'
+        }), 202
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/mpesa-callback', methods=['POST'])
+@api_bp.route('/api/payment-status/<tracking_id>', methods=['GET'])
+def get_payment_status(tracking_id):
+    """Get the outcome of a queued STK push"""
+    try:
+        payment = get_db().get_payment_request(tracking_id)
+        if not payment:
+            return jsonify({'error': 'Payment not found'}), 404
+        
+        return jsonify({
+            'trackingId': payment['tracking_id'],
+            'status': payment['status'],
+            'checkoutRequestID': payment['checkout_request_id'],
+            'customerMessage': payment['customer_message'],
+            'error': payment['error']
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _is_daraja_callback():
+    """Whether the callback carries the token we put in Daraja's CallBackURL"""
+    token = request.args.get('token', '')
+    return bool(MPESA_CALLBACK_TOKEN) and hmac.compare_digest(token.encode(), MPESA_CALLBACK_TOKEN.encode())
+
+@api_bp.route('/api/mpesa-callback', methods=['POST'])
 def mpesa_callback():
     """Handle M-Pesa payment callback"""
     try:
-        data = request.get_json()
+        if not _is_daraja_callback():
+            return jsonify({'error': 'Forbidden'}), 403
         
-        # Process the callback
-        result_code = data.get('ResultCode')
-        checkout_request_id = data.get('CheckoutRequestID')
+        # Daraja nests the result under Body.stkCallback
+        data = request.get_json(silent=True)
+        try:
+            callback = data['Body']['stkCallback']
+            result_code = callback['ResultCode']
+            checkout_request_id = callback['CheckoutRequestID']
+        except (TypeError, KeyError):
+            return jsonify({'error': 'Malformed callback'}), 400
         
-        if result_code == 0:
-            # Payment successful
-            # db.update_transaction_status(checkout_request_id, 'completed')
-            
-            # Get transaction details
-            # transaction = db.get_transaction_by_checkout_id(checkout_request_id)
-            
-            # Activate user package
-            # activate_user_package(transaction['user_id'], transaction['package_id'])
-            pass
-        else:
-            # Payment failed
-            # db.update_transaction_status(checkout_request_id, 'failed')
-            pass
+        db = get_db()
+        transaction = db.get_transaction_by_checkout_id(checkout_request_id)
+        
+        # Daraja may repeat a callback; only settle a transaction once
+        if transaction and transaction['status'] == 'pending':
+            if result_code == 0:
+                # Payment successful - complete the transaction and activate the
+                # package in a single database transaction
+                db.complete_payment(transaction['id'], transaction['user_id'], transaction['package_id'])
+                
+                # Then put the user on the package's profile in MikroTik; the
+                # payment stays recorded if the router can't be reached
+                try:
+                    activate_user_package(transaction['user_id'], transaction['package_id'])
+                except Exception as e:
+                    current_app.logger.error(f"Paid transaction {transaction['id']} not activated: {e}")
+            else:
+                # Payment failed
+                db.update_transaction_status(transaction['id'], 'failed')
         
         return jsonify({'status': 'success'})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/logout', methods=['POST'])
+@api_bp.route('/api/logout', methods=['POST'])
 def logout():
     """Handle user logout"""
     try:
@@ -444,31 +889,37 @@ def logout():
 # UTILITY FUNCTIONS
 # ============================================================================
 
-def get_mpesa_access_token():
-    """Get M-Pesa access token"""
+def send_stk_push(tracking_id, **payment):
+    """Send an STK push and record its outcome against tracking_id"""
+    db = get_db()
     try:
-        response = requests.get(
-            f"https://{MPESA_ENVIRONMENT}.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials",
-            auth=(MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET)
-        )
-        
-        if response.status_code == 200:
-            return response.json()['access_token']
-        else:
-            raise Exception('Failed to get access token')
-            
+        from mpesa_stkpush import process_payment
+        result = process_payment(**payment)
     except Exception as e:
-        raise Exception(f'Access token error: {str(e)}')
-
-def generate_mpesa_password():
-    """Generate M-Pesa password"""
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    password_string = f"{MPESA_PAYBILL}{MPESA_CONSUMER_SECRET}{timestamp}"
-    return hashlib.sha256(password_string.encode()).hexdigest()
+        db.finish_payment_request(tracking_id, 'failed', error=str(e))
+        return
+    
+    if result['success']:
+        # Save transaction to database (implement your database logic here)
+        # transaction = db.create_transaction(...)
+        
+        db.finish_payment_request(
+            tracking_id,
+            'sent',
+            checkout_request_id=result.get('checkout_request_id'),
+            customer_message=result.get('customer_message')
+        )
+    else:
+        db.finish_payment_request(tracking_id, 'failed', error=result.get('error', 'Payment initiation failed'))
 
 def activate_user_package(user_id, package_id):
-    """Activate user package in MikroTik"""
+    """Activate user package in MikroTik
+
+    The database side is settled by Database.complete_payment.
+    """
     try:
+        db = get_db()
+        
         # Get package details
         package = db.get_package_by_id(package_id)
         user = db.get_user_by_id(user_id)
@@ -476,27 +927,17 @@ def activate_user_package(user_id, package_id):
         if not package or not user:
             raise Exception('Package or user not found')
         
-        # Connect to MikroTik
-        connection = routeros_api.RouterOsApiPool(
-            host=MIKROTIK_IP,
-            username=USERNAME,
-            password=PASSWORD,
-            port=MIKROTIK_PORT,
-            use_ssl=MIKROTIK_USE_SSL,
-            ssl_verify=MIKROTIK_SSL_VERIFY,
-            plaintext_login=not MIKROTIK_USE_SSL
-        )
-        api = connection.get_api()
-        
         # Update user profile in MikroTik
-        api.get_resource('/ip/hotspot/user').update(
-            name=user['username'],
-            profile=package['name'],
-            limit_uptime=package['validity']
-        )
-        
-        # Update user in database
-        db.assign_package_to_user(user_id, package_id)
+        with mikrotik_api() as api:
+            users = api.get_resource('/ip/hotspot/user')
+            rows = users.get(name=user['username'])
+            if not rows:
+                raise Exception('Hotspot user not found')
+            users.set(
+                id=rows[0]['id'],
+                profile=package['name'],
+                **{'limit-uptime': f"{package['duration_hours']}h"}
+            )
         
     except Exception as e:
         raise Exception(f'Failed to activate package: {str(e)}')
@@ -505,11 +946,11 @@ def activate_user_package(user_id, package_id):
 # ERROR HANDLERS
 # ============================================================================
 
-@app.errorhandler(404)
+@api_bp.app_errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
-@app.errorhandler(500)
+@api_bp.app_errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
@@ -517,7 +958,20 @@ def internal_error(error):
 # MAIN APPLICATION
 # ============================================================================
 
+def create_app(config_object=None):
+    """Build the Flask application (Gunicorn: flask_api_endpoints:create_app())"""
+    app = Flask(__name__)
+    app.config.from_object(config_object or config)
+    app.json = ORJSONProvider(app)
+    CORS(app)
+    app.register_blueprint(api_bp)
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
+    # Development server only; production runs under Gunicorn gthread workers
+    # (see deploy.py) so RouterOS and Daraja waits overlap across threads
     app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG)
 
 """
@@ -0,0 +1,70 @@
+"""
+FortuNet Flask Helpers
+======================
+
+Response helpers shared by the API server (flask_api_endpoints.py) and the
+standalone MikroTik app (mikrotik_api.py).
+"""
+
+import hashlib
+import sqlite3
+from functools import wraps
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json encoder
+    orjson = None
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes sqlite3.Row query results as objects,
+    encoding with orjson when it is installed"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, sqlite3.Row):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+    if orjson is not None:
+        # Naive datetimes are local time here (SQLite defaults, router
+        # clocks), so they are sent without an offset rather than as UTC
+        _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self._ORJSON_OPTIONS).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            # Hand orjson's bytes straight to the response instead of
+            # decoding to str for Werkzeug to encode again
+            obj = self._prepare_response_obj(args, kwargs)
+            body = orjson.dumps(
+                obj,
+                default=self.default,
+                option=self._ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE
+            )
+            return self._app.response_class(body, mimetype=self.mimetype)
+
+def etagged(view):
+    """Tag a GET view's JSON with a weak ETag and answer matching polls with 304"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        
+        # blake2b is only fingerprinting the body here, not protecting anything
+        etag = hashlib.blake2b(response.get_data(), digest_size=8).hexdigest()
+        headers = {'Cache-Control': 'private, max-age=2'}
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304, headers=headers)
+        else:
+            response.headers.update(headers)
+        response.set_etag(etag, weak=True)
+        return response
+    return wrapper
@@ -9,14 +9,34 @@ for hotspot management, user administration, and network monitoring.
 import routeros_api
 import time
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, request
-from flask_cors import CORS
+from flask import Flask, Response, jsonify, request
 import threading
 import os
 import json
+import queue
+import select
+import socket
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from operator import attrgetter
+from flask_helpers import ORJSONProvider, etagged
+from routeros_api import query
+from routeros_api.exceptions import FatalRouterOsApiError, RouterOsApiConnectionError
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json module
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: plan writes are only serialized per process
+    fcntl = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,12 +44,40 @@ logger = logging.getLogger(__name__)
 
 # Initialize Flask app without automatic .env loading
 app = Flask(__name__)
-CORS(app)  # Enable CORS for React frontend
+app.json = ORJSONProvider(app)
 
 # Disable Flask's automatic .env file loading
 app.config['LOAD_DOTENV'] = False
 
-@dataclass
+# CORS for the React frontend, resolved once at startup
+_CORS_ORIGINS = frozenset(origin.strip() for origin in os.environ.get('CORS_ORIGINS', '*').split(','))
+_CORS_ALLOW_ALL = '*' in _CORS_ORIGINS
+
+@app.before_request
+def _cors_preflight():
+    """Answer CORS preflight requests without dispatching to a route"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+@app.after_request
+def _cors_headers(response):
+    """Add CORS headers for allowed origins"""
+    if _CORS_ALLOW_ALL:
+        response.headers['Access-Control-Allow-Origin'] = '*'
+    else:
+        origin = request.headers.get('Origin')
+        if origin not in _CORS_ORIGINS:
+            return response
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.vary.add('Origin')
+    if request.method == 'OPTIONS':
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = (
+            request.headers.get('Access-Control-Request-Headers') or 'Content-Type, Authorization'
+        )
+    return response
+
+@dataclass(slots=True)
 class MikroTikConfig:
     """MikroTik connection configuration"""
     host: str
@@ -39,8 +87,10 @@ class MikroTikConfig:
     use_ssl: bool = False
     ssl_verify: bool = False
     timeout: int = 10
+    pool_max_size: int = 8
+    pool_max_age: int = 3600
 
-@dataclass
+@dataclass(slots=True)
 class HotspotUser:
     """Hotspot user data structure"""
     id: str
@@ -58,7 +108,7 @@ class HotspotUser:
     created_at: Optional[datetime] = None
     last_seen: Optional[datetime] = None
 
-@dataclass
+@dataclass(slots=True)
 class ActiveSession:
     """Active hotspot session data structure"""
     id: str
@@ -77,7 +127,7 @@ class ActiveSession:
     limit_bytes_out: Optional[int] = None
     limit_bytes_total: Optional[int] = None
 
-@dataclass
+@dataclass(slots=True)
 class HotspotProfile:
     """Hotspot profile data structure"""
     name: str
@@ -89,171 +139,398 @@ class HotspotProfile:
     shared_users: int = 1
     is_active: bool = True
 
+# TTL cache for the read methods polled by the dashboard
+_CacheEntry = namedtuple('_CacheEntry', 'value expires')
+_cache: Dict[tuple, _CacheEntry] = {}
+_cache_locks: Dict[tuple, threading.Lock] = {}
+_cache_lock = threading.Lock()
+
+def ttl_cache(seconds: float):
+    """Cache a MikroTikAPI method's result per instance for `seconds`"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self):
+            key = (id(self), method.__name__)
+            entry = _cache.get(key)
+            if entry is not None and time.monotonic() < entry.expires:
+                return entry.value
+            
+            with _cache_lock:
+                key_lock = _cache_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                # Another thread may have refreshed it while we waited
+                entry = _cache.get(key)
+                if entry is not None and time.monotonic() < entry.expires:
+                    return entry.value
+                value = method(self)
+                _cache[key] = _CacheEntry(value, time.monotonic() + seconds)
+                return value
+        return wrapper
+    return decorator
+
+def invalidate_cache(instance, *method_names: str):
+    """Drop cached results after a write changes what they would return"""
+    for name in method_names:
+        _cache.pop((id(instance), name), None)
+
+def _opt_int(row: Dict[str, str], key: str) -> Optional[int]:
+    """Parse an optional numeric RouterOS field, treating missing/empty as None"""
+    value = row.get(key)
+    return int(value) if value else None
+
+def _session_from_row(session: Dict[str, str]) -> ActiveSession:
+    """Build an ActiveSession from a /ip/hotspot/active row"""
+    get = session.get
+    return ActiveSession(
+        id=get('.id', ''),
+        username=get('user', ''),
+        address=get('address', ''),
+        mac_address=get('mac-address', ''),
+        uptime=get('uptime', ''),
+        idle_time=get('idle-time', ''),
+        session_time_left=get('session-time-left', ''),
+        bytes_in=int(get('bytes-in', 0)),
+        bytes_out=int(get('bytes-out', 0)),
+        profile=get('profile', ''),
+        rate_limit=get('rate-limit'),
+        limit_uptime=get('limit-uptime'),
+        limit_bytes_in=_opt_int(session, 'limit-bytes-in'),
+        limit_bytes_out=_opt_int(session, 'limit-bytes-out'),
+        limit_bytes_total=_opt_int(session, 'limit-bytes-total')
+    )
+
+def _user_from_row(user: Dict[str, str]) -> HotspotUser:
+    """Build a HotspotUser from a /ip/hotspot/user row"""
+    get = user.get
+    return HotspotUser(
+        id=get('.id', ''),
+        username=get('name', ''),
+        password=get('password', ''),
+        profile=get('profile', ''),
+        mac_address=get('mac-address'),
+        comment=get('comment'),
+        limit_uptime=get('limit-uptime'),
+        limit_bytes_in=_opt_int(user, 'limit-bytes-in'),
+        limit_bytes_out=_opt_int(user, 'limit-bytes-out'),
+        limit_bytes_total=_opt_int(user, 'limit-bytes-total'),
+        is_active=get('disabled', 'false') == 'false'
+    )
+
+def _count_async(api, path: str, profiles: Optional[List[str]] = None):
+    """Start a count-only print of path, optionally limited to users of profiles"""
+    additional_queries = ()
+    if profiles:
+        matches = [query.IsEqualQuery('profile', name) for name in profiles]
+        additional_queries = (matches[0] if len(matches) == 1 else query.OrQuery(*matches),)
+    return api.get_binary_resource(path).call_async(
+        'print', {'count-only': b''}, additional_queries=additional_queries
+    )
+
+def _print_all(api, *paths: str) -> List[list]:
+    """Print several menus, sending every command before reading any reply
+
+    routeros_api tags each command, so the replies are matched up however
+    the router interleaves them and the whole batch costs one round-trip.
+    """
+    pending = [api.get_resource(path).get_async() for path in paths]
+    return [promise.get() for promise in pending]
+
+def _count_result(pending) -> int:
+    """Read the number a count-only print returns in its !done reply"""
+    if pending is None:
+        return 0
+    return int(pending.get().done_message.get('ret', b'0'))
+
+def _is_connection_error(error: Exception) -> bool:
+    """Whether error means the RouterOS socket itself is unusable"""
+    return isinstance(error, (RouterOsApiConnectionError, FatalRouterOsApiError, OSError))
+
+class MikroTikConnectionPool:
+    """Pool of RouterOS API connections checked out one request at a time
+
+    routeros_api connections are not thread-safe, so each request gets a
+    connection to itself. Idle slots hold (RouterOsApiPool, api, created_at);
+    connections older than pool_max_age are rebuilt. Dead peers are found
+    by the TCP keepalive routeros_api enables, so reuse needs no probe query.
+    """
+    
+    def __init__(self, config: MikroTikConfig):
+        self.config = config
+        self._idle = queue.Queue()
+        for _ in range(config.pool_max_size):
+            self._idle.put(None)
+    
+    def _open(self) -> tuple:
+        """Open and log in a new RouterOS connection"""
+        # Base connection parameters
+        connection_params = {
+            'host': self.config.host,
+            'username': self.config.username,
+            'password': self.config.password,
+            'port': self.config.port,
+            'plaintext_login': not self.config.use_ssl
+        }
+        
+        # Add SSL parameters if needed
+        if self.config.use_ssl:
+            connection_params['use_ssl'] = True
+            connection_params['ssl_verify'] = self.config.ssl_verify
+        
+        # Try to connect with timeout (for newer versions)
+        try:
+            connection = routeros_api.RouterOsApiPool(timeout=self.config.timeout, **connection_params)
+            logger.debug("Connected using timeout parameter (newer API version)")
+        except TypeError:
+            # Fallback for older versions without timeout support
+            connection = routeros_api.RouterOsApiPool(**connection_params)
+            connection.set_timeout(self.config.timeout)
+            logger.debug("Connected without timeout parameter (older API version)")
+        
+        api = connection.get_api()
+        self._set_nodelay(connection)
+        return (connection, api, time.monotonic())
+    
+    @staticmethod
+    def _set_nodelay(connection):
+        """Turn off Nagle so small commands aren't held back waiting for ACKs"""
+        try:
+            # RouterOsApiPool.socket is the library's SocketWrapper
+            sock = getattr(getattr(connection, 'socket', None), 'socket', None)
+            if isinstance(sock, socket.socket):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            logger.warning(f"Could not set TCP_NODELAY on MikroTik socket: {str(e)}")
+    
+    @staticmethod
+    def _is_stale(connection) -> bool:
+        """Whether an idle connection's socket was closed by the router
+
+        Nothing should be waiting on an idle API socket, so a readable one
+        has hit EOF (or keepalive reset it) and would fail the next command.
+        """
+        sock = getattr(getattr(connection, 'socket', None), 'socket', None)
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+    
+    @staticmethod
+    def _discard(entry: tuple):
+        try:
+            entry[0].disconnect()
+        except Exception:
+            pass
+    
+    def _checkout(self) -> tuple:
+        entry = self._idle.get()
+        try:
+            if entry is not None:
+                connection, _, created_at = entry
+                if (time.monotonic() - created_at > self.config.pool_max_age
+                        or self._is_stale(connection)):
+                    self._discard(entry)
+                    entry = None
+            if entry is None:
+                entry = self._open()
+        except Exception:
+            self._idle.put(None)
+            raise
+        return entry
+    
+    @contextmanager
+    def acquire(self):
+        """Yield the API handle of a pooled connection, waiting if all are in use"""
+        entry = self._checkout()
+        try:
+            yield entry[1]
+        except Exception as e:
+            if _is_connection_error(e):
+                self._discard(entry)
+                entry = None
+            raise
+        finally:
+            self._idle.put(entry)
+    
+    def close_all(self):
+        """Disconnect every idle connection"""
+        for _ in range(self._idle.qsize()):
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                self._discard(entry)
+            self._idle.put(None)
+
 class MikroTikAPI:
     """Main MikroTik RouterOS API integration class"""
     
     def __init__(self, config: MikroTikConfig):
         self.config = config
-        self.connection = None
-        self.api = None
+        self.pool = MikroTikConnectionPool(config)
         self._connect()
     
     def _connect(self):
-        """Establish connection to MikroTik device"""
+        """Open the first pooled connection to check the router is reachable"""
         try:
-            # Base connection parameters
-            connection_params = {
-                'host': self.config.host,
-                'username': self.config.username,
-                'password': self.config.password,
-                'port': self.config.port,
-                'plaintext_login': not self.config.use_ssl
-            }
-            
-            # Add SSL parameters if needed
-            if self.config.use_ssl:
-                connection_params['use_ssl'] = True
-                connection_params['ssl_verify'] = self.config.ssl_verify
-            
-            # Try to connect with timeout (for newer versions)
-            try:
-                connection_params['timeout'] = self.config.timeout
-                self.connection = routeros_api.RouterOsApiPool(**connection_params)
-                logger.info("Connected using timeout parameter (newer API version)")
-            except TypeError:
-                # Fallback for older versions without timeout support
-                if 'timeout' in connection_params:
-                    del connection_params['timeout']
-                self.connection = routeros_api.RouterOsApiPool(**connection_params)
-                logger.info("Connected without timeout parameter (older API version)")
-            
-            self.api = self.connection.get_api()
+            with self.pool.acquire():
+                pass
             logger.info(f"Successfully connected to MikroTik at {self.config.host}")
-            
         except Exception as e:
             logger.error(f"Failed to connect to MikroTik: {str(e)}")
-            # Don't raise immediately - the router might be offline
-            # We'll try to reconnect when needed
+            # Don't raise - the router might be offline
+            # Connections are opened on demand when it comes back
     
-    def _reconnect_if_needed(self):
-        """Reconnect if connection is lost"""
-        if self.api is None:
-            logger.info("No active connection, attempting to connect...")
-            self._connect()
-            return
-            
+    def _call_with_reconnect(self, fn: Callable[[Any], Any]) -> Any:
+        """Run a read fn(api) on a pooled connection, retrying once on a fresh one
+
+        The pool drops a connection that fails at the socket level, so the
+        retry gets a reconnected one without probing the router up front.
+        Writes go through _call_once instead.
+        """
         try:
-            # Test connection with a simple API call
-            self.api.get_resource('/system/resource').get()
+            with self.pool.acquire() as api:
+                return fn(api)
         except Exception as e:
-            logger.warning(f"Connection lost ({str(e)}), attempting to reconnect...")
-            try:
-                if self.connection:
-                    self.connection.disconnect()
-            except:
-                pass
-            self.connection = None
-            self.api = None
-            self._connect()
+            if not _is_connection_error(e):
+                raise
+            logger.warning(f"MikroTik connection lost, reconnecting: {str(e)}")
+        with self.pool.acquire() as api:
+            return fn(api)
+    
+    def _call_once(self, fn: Callable[[Any], Any]) -> Any:
+        """Run a write fn(api) on a pooled connection without retrying
+
+        The router may have applied the write before the socket failed, so
+        sending it again could duplicate it; the error goes to the caller.
+        """
+        with self.pool.acquire() as api:
+            return fn(api)
+    
+    def ping(self) -> bool:
+        """Check that a pooled connection can talk to the router"""
+        try:
+            self._call_with_reconnect(lambda api: api.get_resource('/system/identity').get())
+            return True
+        except Exception as e:
+            logger.warning(f"MikroTik ping failed: {str(e)}")
+            return False
+    
+    # The cached _fetch_* methods raise on router errors so a failure is
+    # never cached; the public getters log it and return an empty result
+    
+    @ttl_cache(seconds=5)
+    def _fetch_system_info(self) -> Dict[str, Any]:
+        resource, identity = self._call_with_reconnect(
+            lambda api: _print_all(api, '/system/resource', '/system/identity')
+        )
+        
+        if resource and identity:
+            return {
+                'cpu_load': resource[0].get('cpu-load', 'N/A'),
+                'free_memory': resource[0].get('free-memory', 'N/A'),
+                'total_memory': resource[0].get('total-memory', 'N/A'),
+                'free_hdd_space': resource[0].get('free-hdd-space', 'N/A'),
+                'total_hdd_space': resource[0].get('total-hdd-space', 'N/A'),
+                'version': resource[0].get('version', 'N/A'),
+                'uptime': resource[0].get('uptime', 'N/A'),
+                'identity': identity[0].get('name', 'N/A')
+            }
+        return {}
     
     def get_system_info(self) -> Dict[str, Any]:
         """Get system information"""
         try:
-            self._reconnect_if_needed()
-            if self.api is None:
-                return {}
-                
-            resource = self.api.get_resource('/system/resource').get()
-            identity = self.api.get_resource('/system/identity').get()
-            
-            if resource and identity:
-                return {
-                    'cpu_load': resource[0].get('cpu-load', 'N/A'),
-                    'free_memory': resource[0].get('free-memory', 'N/A'),
-                    'total_memory': resource[0].get('total-memory', 'N/A'),
-                    'free_hdd_space': resource[0].get('free-hdd-space', 'N/A'),
-                    'total_hdd_space': resource[0].get('total-hdd-space', 'N/A'),
-                    'version': resource[0].get('version', 'N/A'),
-                    'uptime': resource[0].get('uptime', 'N/A'),
-                    'identity': identity[0].get('name', 'N/A')
-                }
-            return {}
+            return self._fetch_system_info()
         except Exception as e:
             logger.error(f"Failed to get system info: {str(e)}")
             return {}
     
+    @ttl_cache(seconds=2)
+    def _fetch_active_sessions(self) -> List[ActiveSession]:
+        sessions = self._call_with_reconnect(lambda api: api.get_resource('/ip/hotspot/active').get())
+        return [_session_from_row(session) for session in sessions]
+    
     def get_active_sessions(self) -> List[ActiveSession]:
         """Get all active hotspot sessions"""
         try:
-            self._reconnect_if_needed()
-            if self.api is None:
-                return []
-                
-            sessions = self.api.get_resource('/ip/hotspot/active').get()
-            
-            result = []
-            for session in sessions:
-                result.append(ActiveSession(
-                    id=session.get('.id', ''),
-                    username=session.get('user', ''),
-                    address=session.get('address', ''),
-                    mac_address=session.get('mac-address', ''),
-                    uptime=session.get('uptime', ''),
-                    idle_time=session.get('idle-time', ''),
-                    session_time_left=session.get('session-time-left', ''),
-                    bytes_in=int(session.get('bytes-in', 0)),
-                    bytes_out=int(session.get('bytes-out', 0)),
-                    profile=session.get('profile', ''),
-                    rate_limit=session.get('rate-limit'),
-                    limit_uptime=session.get('limit-uptime'),
-                    limit_bytes_in=int(session.get('limit-bytes-in', 0)) if session.get('limit-bytes-in') else None,
-                    limit_bytes_out=int(session.get('limit-bytes-out', 0)) if session.get('limit-bytes-out') else None,
-                    limit_bytes_total=int(session.get('limit-bytes-total', 0)) if session.get('limit-bytes-total') else None
-                ))
-            
-            return result
+            return self._fetch_active_sessions()
         except Exception as e:
             logger.error(f"Failed to get active sessions: {str(e)}")
             return []
     
+    @ttl_cache(seconds=10)
+    def _fetch_hotspot_users(self) -> List[HotspotUser]:
+        users = self._call_with_reconnect(lambda api: api.get_resource('/ip/hotspot/user').get())
+        return [_user_from_row(user) for user in users]
+    
     def get_hotspot_users(self) -> List[HotspotUser]:
         """Get all hotspot users"""
         try:
-            self._reconnect_if_needed()
-            if self.api is None:
-                return []
-                
-            users = self.api.get_resource('/ip/hotspot/user').get()
-            
-            result = []
-            for user in users:
-                result.append(HotspotUser(
-                    id=user.get('.id', ''),
-                    username=user.get('name', ''),
-                    password=user.get('password', ''),
-                    profile=user.get('profile', ''),
-                    mac_address=user.get('mac-address'),
-                    comment=user.get('comment'),
-                    limit_uptime=user.get('limit-uptime'),
-                    limit_bytes_in=int(user.get('limit-bytes-in', 0)) if user.get('limit-bytes-in') else None,
-                    limit_bytes_out=int(user.get('limit-bytes-out', 0)) if user.get('limit-bytes-out') else None,
-                    limit_bytes_total=int(user.get('limit-bytes-total', 0)) if user.get('limit-bytes-total') else None,
-                    is_active=user.get('disabled', 'false') == 'false'
-                ))
-            
-            return result
+            return self._fetch_hotspot_users()
         except Exception as e:
             logger.error(f"Failed to get hotspot users: {str(e)}")
             return []
     
+    @ttl_cache(seconds=60)
+    def _fetch_hotspot_profile_names(self) -> List[str]:
+        profiles = self._call_with_reconnect(
+            lambda api: api.get_resource('/ip/hotspot/user/profile').call('print', {'.proplist': 'name'})
+        )
+        return [profile.get('name', '') for profile in profiles]
+    
+    def get_hotspot_profile_names(self) -> List[str]:
+        """Get the names of all hotspot user profiles"""
+        try:
+            return self._fetch_hotspot_profile_names()
+        except Exception as e:
+            logger.error(f"Failed to get hotspot profiles: {str(e)}")
+            return []
+    
+    @ttl_cache(seconds=2)
+    def _fetch_user_counts(self) -> Dict[str, int]:
+        """Count active sessions, hotspot users and PPPoE/static-profile users
+
+        RouterOS queries only match whole values, so the profiles whose name
+        contains 'pppoe' or 'static' are looked up first and the users on any
+        of them are counted. The counts are pipelined on one connection.
+        """
+        pppoe_profiles = []
+        static_profiles = []
+        for name in self._fetch_hotspot_profile_names():
+            lowered = name.lower()
+            if 'pppoe' in lowered:
+                pppoe_profiles.append(name)
+            if 'static' in lowered:
+                static_profiles.append(name)
+        
+        def count(api):
+            pending = {
+                'active': _count_async(api, '/ip/hotspot/active'),
+                'users': _count_async(api, '/ip/hotspot/user'),
+                'pppoe': _count_async(api, '/ip/hotspot/user', pppoe_profiles) if pppoe_profiles else None,
+                'static': _count_async(api, '/ip/hotspot/user', static_profiles) if static_profiles else None
+            }
+            return {name: _count_result(promise) for name, promise in pending.items()}
+        
+        return self._call_with_reconnect(count)
+    
+    def get_user_counts(self) -> Dict[str, int]:
+        """Count active sessions, hotspot users and PPPoE/static-profile users"""
+        try:
+            return self._fetch_user_counts()
+        except Exception as e:
+            logger.error(f"Failed to count hotspot users: {str(e)}")
+            return {'active': 0, 'users': 0, 'pppoe': 0, 'static': 0}
+    
     def disconnect_user(self, session_id: str) -> bool:
         """Disconnect a user from hotspot"""
         try:
-            self._reconnect_if_needed()
-            if self.api is None:
-                return False
-                
-            self.api.get_resource('/ip/hotspot/active').remove(id=session_id)
+            self._call_once(lambda api: api.get_resource('/ip/hotspot/active').remove(id=session_id))
+            invalidate_cache(self, '_fetch_active_sessions', '_fetch_user_counts')
             logger.info(f"Disconnected user session: {session_id}")
             return True
         except Exception as e:
@@ -263,16 +540,12 @@ class MikroTikAPI:
     def block_user(self, ip_address: str, comment: str = "") -> bool:
         """Block a user by IP address"""
         try:
-            self._reconnect_if_needed()
-            if self.api is None:
-                return False
-            
             # Add to address list for blocking
-            self.api.get_resource('/ip/firewall/address-list').add(
+            self._call_once(lambda api: api.get_resource('/ip/firewall/address-list').add(
                 address=ip_address,
                 list='blocked_users',
                 comment=comment or f'Blocked user: {ip_address}'
-            )
+            ))
             
             logger.info(f"Blocked user IP: {ip_address}")
             return True
@@ -284,10 +557,6 @@ class MikroTikAPI:
                            mac_address: Optional[str] = None, comment: Optional[str] = None) -> bool:
         """Create a new hotspot user"""
         try:
-            self._reconnect_if_needed()
-            if self.api is None:
-                return False
-                
             user_data = {
                 'name': username,
                 'password': password,
@@ -299,7 +568,8 @@ class MikroTikAPI:
             if comment:
                 user_data['comment'] = comment
                 
-            self.api.get_resource('/ip/hotspot/user').add(**user_data)
+            self._call_once(lambda api: api.get_resource('/ip/hotspot/user').add(**user_data))
+            invalidate_cache(self, '_fetch_hotspot_users', '_fetch_user_counts')
             logger.info(f"Created hotspot user: {username}")
             return True
             
@@ -308,18 +578,13 @@ class MikroTikAPI:
             return False
     
     def close(self):
-        """Close the connection"""
-        if self.connection:
-            try:
-                self.connection.disconnect()
-                logger.info("MikroTik connection closed")
-            except:
-                pass
-        self.connection = None
-        self.api = None
+        """Close the pooled connections"""
+        self.pool.close_all()
+        logger.info("MikroTik connections closed")
 
-# Global MikroTik API instance
+# Global MikroTik API instance (one per Gunicorn worker)
 mikrotik_api = None
+_mikrotik_init_lock = threading.Lock()
 
 def initialize_mikrotik():
     """Initialize the MikroTik connection"""
@@ -331,7 +596,9 @@ def initialize_mikrotik():
             password="123456",  # Replace with your actual password
             port=8728,
             use_ssl=False,
-            timeout=10
+            timeout=10,
+            pool_max_size=int(os.environ.get('POOL_MAX_SIZE', '8')),
+            pool_max_age=int(os.environ.get('POOL_MAX_AGE', '3600'))
         )
         mikrotik_api = MikroTikAPI(config)
         return True
@@ -339,76 +606,92 @@ def initialize_mikrotik():
         logger.error(f"Failed to initialize MikroTik: {e}")
         return False
 
+@app.before_request
+def _ensure_mikrotik():
+    """Create this process's MikroTikAPI on its first request
+
+    Gunicorn imports the app before forking, so connecting at import time
+    would share sockets between workers.
+    """
+    if mikrotik_api is None:
+        with _mikrotik_init_lock:
+            if mikrotik_api is None:
+                initialize_mikrotik()
+
 # Flask API Routes
 @app.route('/api/system-info', methods=['GET'])
+@etagged
 def get_system_info():
     """Get system information from MikroTik"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'error': 'MikroTik not connected'}), 500
         
-        system_info = mikrotik_api.get_system_info()
+        system_info = api.get_system_info()
         return jsonify(system_info)
     except Exception as e:
         logger.error(f"Error getting system info: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _stream_json_array(items, chunk_size: int = 256):
+    """Yield items as a JSON array, encoded a chunk of rows at a time
+
+    Large session/user lists never exist as a single JSON string.
+    """
+    if orjson is not None:
+        dumps = lambda item: orjson.dumps(item, default=app.json.default)
+    else:
+        dumps = lambda item: app.json.dumps(item).encode()
+    
+    yield b'['
+    chunk = []
+    separator = b''
+    for item in items:
+        chunk.append(dumps(item))
+        if len(chunk) == chunk_size:
+            yield separator + b','.join(chunk)
+            separator = b','
+            chunk = []
+    if chunk:
+        yield separator + b','.join(chunk)
+    yield b']\n'
+
 @app.route('/api/active-sessions', methods=['GET'])
 def get_active_sessions():
     """Get active hotspot sessions"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'error': 'MikroTik not connected'}), 500
         
-        sessions = mikrotik_api.get_active_sessions()
-        # Convert to dict for JSON serialization
-        sessions_dict = [{
-            'id': session.id,
-            'username': session.username,
-            'address': session.address,
-            'mac_address': session.mac_address,
-            'uptime': session.uptime,
-            'idle_time': session.idle_time,
-            'session_time_left': session.session_time_left,
-            'bytes_in': session.bytes_in,
-            'bytes_out': session.bytes_out,
-            'profile': session.profile,
-            'rate_limit': session.rate_limit,
-            'limit_uptime': session.limit_uptime,
-            'limit_bytes_in': session.limit_bytes_in,
-            'limit_bytes_out': session.limit_bytes_out,
-            'limit_bytes_total': session.limit_bytes_total
-        } for session in sessions]
-        
-        return jsonify(sessions_dict)
+        # ActiveSession's fields are exactly the JSON keys, so the
+        # dataclasses are serialized as they are
+        sessions = api.get_active_sessions()
+        return Response(_stream_json_array(sessions), mimetype='application/json')
     except Exception as e:
         logger.error(f"Error getting active sessions: {e}")
         return jsonify({'error': str(e)}), 500
 
+_USER_JSON_FIELDS = ('id', 'username', 'password', 'profile', 'mac_address', 'comment',
+                     'limit_uptime', 'limit_bytes_in', 'limit_bytes_out', 'limit_bytes_total',
+                     'is_active')
+_user_json_values = attrgetter(*_USER_JSON_FIELDS)
+
 @app.route('/api/hotspot-users', methods=['GET'])
 def get_hotspot_users():
     """Get all hotspot users"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'error': 'MikroTik not connected'}), 500
         
-        users = mikrotik_api.get_hotspot_users()
-        # Convert to dict for JSON serialization
-        users_dict = [{
-            'id': user.id,
-            'username': user.username,
-            'password': user.password,
-            'profile': user.profile,
-            'mac_address': user.mac_address,
-            'comment': user.comment,
-            'limit_uptime': user.limit_uptime,
-            'limit_bytes_in': user.limit_bytes_in,
-            'limit_bytes_out': user.limit_bytes_out,
-            'limit_bytes_total': user.limit_bytes_total,
-            'is_active': user.is_active
-        } for user in users]
+        users = api.get_hotspot_users()
+        # Convert to dicts as they are streamed, leaving out the
+        # fields RouterOS never fills in
+        users_dict = (dict(zip(_USER_JSON_FIELDS, _user_json_values(user))) for user in users)
         
-        return jsonify(users_dict)
+        return Response(_stream_json_array(users_dict), mimetype='application/json')
     except Exception as e:
         logger.error(f"Error getting hotspot users: {e}")
         return jsonify({'error': str(e)}), 500
@@ -417,10 +700,11 @@ def get_hotspot_users():
 def disconnect_user(session_id):
     """Disconnect a user session"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'error': 'MikroTik not connected'}), 500
         
-        success = mikrotik_api.disconnect_user(session_id)
+        success = api.disconnect_user(session_id)
         if success:
             return jsonify({'message': 'User disconnected successfully'})
         else:
@@ -433,10 +717,11 @@ def disconnect_user(session_id):
 def block_user(ip_address):
     """Block a user by IP address"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'error': 'MikroTik not connected'}), 500
         
-        success = mikrotik_api.block_user(ip_address)
+        success = api.block_user(ip_address)
         if success:
             return jsonify({'message': 'User blocked successfully'})
         else:
@@ -449,7 +734,8 @@ def block_user(ip_address):
 def create_user():
     """Create a new hotspot user"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'error': 'MikroTik not connected'}), 500
         
         data = request.get_json()
@@ -462,7 +748,7 @@ def create_user():
         if not username or not password:
             return jsonify({'error': 'Username and password are required'}), 400
         
-        success = mikrotik_api.create_hotspot_user(username, password, profile, mac_address, comment)
+        success = api.create_hotspot_user(username, password, profile, mac_address, comment)
         if success:
             return jsonify({'message': 'User created successfully'})
         else:
@@ -475,12 +761,12 @@ def create_user():
 def health_check():
     """Health check endpoint"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'status': 'disconnected', 'message': 'MikroTik not connected'}), 500
         
         # Test connection
-        mikrotik_api._reconnect_if_needed()
-        if mikrotik_api.api is None:
+        if not api.ping():
             return jsonify({'status': 'disconnected', 'message': 'MikroTik connection lost'}), 500
         
         return jsonify({'status': 'connected', 'message': 'MikroTik is connected'})
@@ -488,25 +774,26 @@ def health_check():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/stats', methods=['GET'])
+@etagged
 def get_stats():
     """Get dashboard statistics"""
     try:
-        if not mikrotik_api:
+        api = mikrotik_api
+        if not api:
             return jsonify({'error': 'MikroTik not connected'}), 500
         
-        # Get all necessary data
-        sessions = mikrotik_api.get_active_sessions()
-        users = mikrotik_api.get_hotspot_users()
+        # Counted on the router instead of transferring the lists
+        counts = api.get_user_counts()
         
         # Calculate statistics
-        active_users = len(sessions)
-        total_users = len(users)
+        active_users = counts['active']
+        total_users = counts['users']
         
         # Simple revenue calculations (replace with your actual logic)
         total_revenue = total_users * 1000  # Example: KES 1000 per user
         monthly_revenue = total_revenue
-        pppoe_revenue = len([u for u in users if 'pppoe' in u.profile.lower()]) * 1200
-        static_revenue = len([u for u in users if 'static' in u.profile.lower()]) * 1500
+        pppoe_revenue = counts['pppoe'] * 1200
+        static_revenue = counts['static'] * 1500
         hotspot_revenue = active_users * 200
         
         stats = {
@@ -552,8 +839,19 @@ def start_flask_app():
     print("  GET  /api/stats            - Get dashboard statistics")
     print("  GET  /api/health           - Health check")
     
-    # Run without debug mode to avoid .env file issues
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # Serve with Gunicorn's threaded workers; the Werkzeug dev server
+    # handles one request at a time
+    workers = os.environ.get('WEB_CONCURRENCY', '4')
+    try:
+        os.execvp('gunicorn', [
+            'gunicorn', '-k', 'gthread', '--workers', workers, '--threads', '8',
+            '-b', '0.0.0.0:5000', '--chdir', os.path.dirname(os.path.abspath(__file__)),
+            'mikrotik_api:app'
+        ])
+    except FileNotFoundError:
+        logger.warning("gunicorn not found, falling back to the Flask development server")
+        # Run without debug mode to avoid .env file issues
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
 
 # Example usage and main entry point
 if __name__ == "__main__":
@@ -587,20 +885,62 @@ import os
 # Add this after your other routes
 PLANS_FILE = 'internet_plans.json'
 
+# Parsed plans, reused until the file's mtime changes
+_plans_cache = None
+_plans_mtime = 0
+
+# Held for the whole load-change-save of the plans file
+_plans_lock = threading.Lock()
+
+@contextmanager
+def plans_update():
+    """Serialize plan edits across threads and Gunicorn workers"""
+    with _plans_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(PLANS_FILE + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def load_plans():
-    """Load internet plans from JSON file"""
-    if os.path.exists(PLANS_FILE):
-        try:
-            with open(PLANS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    """Load internet plans from JSON file
+
+    The returned list is shared between requests; copy it before changing it.
+    """
+    global _plans_cache, _plans_mtime
+    try:
+        mtime = os.stat(PLANS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    if _plans_cache is not None and mtime == _plans_mtime:
+        return _plans_cache
+    try:
+        with open(PLANS_FILE, 'rb') as f:
+            data = f.read()
+        plans = orjson.loads(data) if orjson else json.loads(data)
+    except:
+        return []
+    _plans_cache, _plans_mtime = plans, mtime
+    return plans
 
 def save_plans(plans):
-    """Save internet plans to JSON file"""
-    with open(PLANS_FILE, 'w') as f:
-        json.dump(plans, f, indent=2)
+    """Save internet plans to JSON file (call inside plans_update())"""
+    global _plans_cache, _plans_mtime
+    data = orjson.dumps(plans) if orjson else json.dumps(plans, separators=(',', ':')).encode()
+    # A private temp file per write, so a concurrent save can't swap ours out
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(PLANS_FILE) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, PLANS_FILE)
+    except Exception:
+        os.unlink(tmp_file)
+        raise
+    _plans_cache, _plans_mtime = plans, os.stat(PLANS_FILE).st_mtime_ns
 
 @app.route('/api/internet-plans', methods=['GET'])
 def get_internet_plans():
@@ -612,36 +952,64 @@ def get_internet_plans():
         logger.error(f"Error getting internet plans: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Internet plan fields and the JSON types each may take
+_PLAN_REQUIRED_FIELDS = (
+    ('name', str),
+    ('price', (int, float)),
+    ('speed', str),
+    ('duration', str),
+    ('data_limit', str),
+)
+_PLAN_OPTIONAL_FIELDS = (
+    ('description', str),
+    ('is_active', bool),
+)
+
+def _validate_plan(data):
+    """Return an error message for a malformed internet plan body, else None"""
+    if not isinstance(data, dict):
+        return 'Request body must be a JSON object'
+    for field, types in _PLAN_REQUIRED_FIELDS:
+        value = data.get(field)
+        if not value:
+            return f'{field} is required'
+        if not isinstance(value, types) or isinstance(value, bool):
+            return f'Invalid value for field: {field}'
+    for field, types in _PLAN_OPTIONAL_FIELDS:
+        if field in data and not isinstance(data[field], types):
+            return f'Invalid value for field: {field}'
+    return None
+
 @app.route('/api/internet-plans', methods=['POST'])
 def create_internet_plan():
     """Create a new internet plan"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
         # Validate required fields
-        required_fields = ['name', 'price', 'speed', 'duration', 'data_limit']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} is required'}), 400
-        
-        plans = load_plans()
-        
-        # Create new plan
-        new_plan = {
-            'id': len(plans) + 1,
-            'name': data['name'],
-            'price': data['price'],
-            'speed': data['speed'],
-            'duration': data['duration'],
-            'data_limit': data['data_limit'],
-            'description': data.get('description', ''),
-            'is_active': data.get('is_active', True),
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
-        }
+        error = _validate_plan(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        plans.append(new_plan)
-        save_plans(plans)
+        with plans_update():
+            plans = list(load_plans())
+            
+            # Create new plan
+            new_plan = {
+                'id': len(plans) + 1,
+                'name': data['name'],
+                'price': data['price'],
+                'speed': data['speed'],
+                'duration': data['duration'],
+                'data_limit': data['data_limit'],
+                'description': data.get('description', ''),
+                'is_active': data.get('is_active', True),
+                'created_at': datetime.now().isoformat(),
+                'updated_at': datetime.now().isoformat()
+            }
+            
+            plans.append(new_plan)
+            save_plans(plans)
         
         return jsonify(new_plan), 201
     except Exception as e:
@@ -653,19 +1021,20 @@ def update_internet_plan(plan_id):
     """Update an internet plan"""
     try:
         data = request.get_json()
-        plans = load_plans()
-        
-        plan_index = next((i for i, p in enumerate(plans) if p['id'] == plan_id), None)
-        if plan_index is None:
-            return jsonify({'error': 'Plan not found'}), 404
-        
-        # Update plan
-        plans[plan_index].update({
-            **data,
-            'updated_at': datetime.now().isoformat()
-        })
-        
-        save_plans(plans)
+        with plans_update():
+            plans = [dict(plan) for plan in load_plans()]
+            
+            plan_index = next((i for i, p in enumerate(plans) if p['id'] == plan_id), None)
+            if plan_index is None:
+                return jsonify({'error': 'Plan not found'}), 404
+            
+            # Update plan
+            plans[plan_index].update({
+                **data,
+                'updated_at': datetime.now().isoformat()
+            })
+            
+            save_plans(plans)
         return jsonify(plans[plan_index])
     except Exception as e:
         logger.error(f"Error updating internet plan: {e}")
@@ -675,14 +1044,15 @@ def update_internet_plan(plan_id):
 def delete_internet_plan(plan_id):
     """Delete an internet plan"""
     try:
-        plans = load_plans()
-        plan_index = next((i for i, p in enumerate(plans) if p['id'] == plan_id), None)
-        
-        if plan_index is None:
-            return jsonify({'error': 'Plan not found'}), 404
-        
-        deleted_plan = plans.pop(plan_index)
-        save_plans(plans)
+        with plans_update():
+            plans = list(load_plans())
+            plan_index = next((i for i, p in enumerate(plans) if p['id'] == plan_id), None)
+            
+            if plan_index is None:
+                return jsonify({'error': 'Plan not found'}), 404
+            
+            deleted_plan = plans.pop(plan_index)
+            save_plans(plans)
         
         return jsonify({'message': 'Plan deleted successfully', 'plan': deleted_plan})
     except Exception as e:
@@ -6,122 +6,312 @@ This module handles M-Pesa STK push integration for FortuNet hotspot billing sys
 """
 
 import requests
-import hashlib
-import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import base64
 import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from config import get_config
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json module
+    orjson = None
+
+try:
+    import redis
+except ImportError:  # tokens are then cached per process only
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+class MpesaError(Exception):
+    """Daraja answered, but not with what we asked for"""
+
+# (connect, read) timeouts for Daraja calls
+REQUEST_TIMEOUT = (3.05, 8)
+
+# Redis key holding the access token shared by all Gunicorn workers
+SHARED_TOKEN_KEY = 'mpesa:token'
+
+def _dumps(data):
+    """Encode a request body to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+def _loads(content):
+    """Decode a JSON response body"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def make_timestamp():
+    """Daraja timestamp (local time, YYYYMMDDHHMMSS)"""
+    return time.strftime('%Y%m%d%H%M%S', time.localtime())
 
 class MpesaSTKPush:
-    def __init__(self, consumer_key, consumer_secret, paybill, environment='sandbox'):
+    __slots__ = (
+        'consumer_key', 'consumer_secret', 'paybill', 'passkey', 'environment', 'base_url',
+        'access_token', '_password_prefix', '_oauth_url', '_stk_url', '_stk_template',
+        '_stk_headers', '_token_expiry', '_token_lock', '_session', '_redis'
+    )
+    
+    def __init__(self, consumer_key, consumer_secret, paybill, passkey, environment='sandbox',
+                 redis_client=None):
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.paybill = paybill
+        self.passkey = passkey
+        # Constant part of every STK push password
+        self._password_prefix = f"{paybill}{passkey}".encode()
         self.environment = environment
         self.base_url = f"https://{environment}.safaricom.co.ke"
+        self._oauth_url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
+        self._stk_url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
         self.access_token = None
+        # STK push fields that are the same for every payment
+        self._stk_template = {
+            "BusinessShortCode": paybill,
+            "TransactionType": "CustomerPayBillOnline",
+            "PartyB": paybill
+        }
+        # STK push headers, rebuilt whenever the token changes
+        self._stk_headers = None
+        self._token_expiry = 0.0
+        self._token_lock = threading.Lock()
+        # Optional Redis so workers reuse one token instead of each fetching
+        self._redis = redis_client
+        
+        # Keep-alive connections to Daraja are reused across calls (sized for
+        # process_payments_batch's workers). Failed connects are retried for
+        # any method since nothing was sent; 5xx retries stay limited to
+        # idempotent methods so an STK push is never resent.
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.2,
+                              status_forcelist=[502, 503, 504])
+        ))
+    
+    def close(self):
+        """Close pooled connections"""
+        self._session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def get_access_token(self):
-        """Get M-Pesa access token"""
-        try:
-            url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-            response = requests.get(url, auth=(self.consumer_key, self.consumer_secret))
-            
-            if response.status_code == 200:
-                data = response.json()
-                self.access_token = data['access_token']
+        """Get M-Pesa access token, reusing it until shortly before it expires"""
+        if self.access_token and time.monotonic() < self._token_expiry:
+            return self.access_token
+        
+        with self._token_lock:
+            # Another thread may have refreshed it while we waited
+            if self.access_token and time.monotonic() < self._token_expiry:
+                return self.access_token
+            # Another worker may already hold a valid token
+            if self._load_shared_token():
                 return self.access_token
-            else:
-                raise Exception(f"Failed to get access token: {response.status_code}")
-        except Exception as e:
-            raise Exception(f"Access token error: {str(e)}")
+            return self._fetch_access_token()
     
-    def generate_password(self):
-        """Generate M-Pesa password"""
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        password_string = f"{self.paybill}{self.consumer_secret}{timestamp}"
-        return hashlib.sha256(password_string.encode()).hexdigest()
+    def _set_token(self, token, expires_in):
+        """Adopt token, valid for expires_in seconds from now"""
+        self.access_token = token
+        self._stk_headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+        # Refresh a minute early so a token never expires mid-request
+        self._token_expiry = time.monotonic() + expires_in - 60
     
-    def initiate_stk_push(self, phone_number, amount, package_name, account_reference, callback_url):
+    def _load_shared_token(self):
+        """Adopt the token in Redis if it has more than a minute left"""
+        if self._redis is None:
+            return False
+        try:
+            with self._redis.pipeline() as pipe:
+                value, ttl_ms = pipe.get(SHARED_TOKEN_KEY).pttl(SHARED_TOKEN_KEY).execute()
+        except redis.RedisError:
+            return False
+        if value is None or ttl_ms <= 60000:
+            return False
+        self._set_token(value.decode(), ttl_ms / 1000.0)
+        return True
+    
+    def _fetch_access_token(self):
+        """Request a new access token from the OAuth endpoint
+
+        Raises requests.RequestException if Daraja can't be reached and
+        MpesaError if it refuses the credentials.
+        """
+        response = self._session.get(
+            self._oauth_url,
+            auth=(self.consumer_key, self.consumer_secret),
+            timeout=REQUEST_TIMEOUT
+        )
+        
+        if response.status_code != 200:
+            raise MpesaError(f"Failed to get access token: {response.status_code}")
+        try:
+            data = _loads(response.content)
+            token = data['access_token']
+        except (ValueError, KeyError):
+            raise MpesaError("Access token missing from OAuth response")
+        expires_in = int(data.get('expires_in', 3599))
+        self._set_token(token, expires_in)
+        
+        if self._redis is not None:
+            try:
+                self._redis.set(SHARED_TOKEN_KEY, token, ex=expires_in)
+            except redis.RedisError:
+                pass
+        return token
+    
+    def generate_password(self, timestamp):
+        """Generate M-Pesa password for the request's timestamp
+
+        Daraja expects Base64(BusinessShortCode + Passkey + Timestamp), and
+        the request must send that same timestamp.
+        """
+        return base64.b64encode(self._password_prefix + timestamp.encode()).decode()
+    
+    def initiate_stk_push(self, phone_number, amount, package_name, account_reference, callback_url,
+                          timestamp=None):
         """Initiate STK push request"""
         try:
-            access_token = self.get_access_token()
-            timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-            password = self.generate_password()
+            self.get_access_token()
+            headers = self._stk_headers
+            if timestamp is None:
+                timestamp = make_timestamp()
+            password = self.generate_password(timestamp)
             
             stk_push_data = {
-                "BusinessShortCode": self.paybill,
+                **self._stk_template,
                 "Password": password,
                 "Timestamp": timestamp,
-                "TransactionType": "CustomerPayBillOnline",
                 "Amount": amount,
                 "PartyA": phone_number,
-                "PartyB": self.paybill,
                 "PhoneNumber": phone_number,
                 "CallBackURL": callback_url,
                 "AccountReference": account_reference,
                 "TransactionDesc": f"FortuNet {package_name}"
             }
             
-            url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.post(url, headers=headers, json=stk_push_data)
+            response = self._session.post(self._stk_url, headers=headers, data=_dumps(stk_push_data), timeout=REQUEST_TIMEOUT)
             
-            if response.status_code == 200:
-                result = response.json()
+            response.raise_for_status()
+            result = _loads(response.content)
+            if result.get('ResponseCode') != '0':
                 return {
-                    'success': True,
-                    'checkout_request_id': result.get('CheckoutRequestID'),
-                    'merchant_request_id': result.get('MerchantRequestID'),
-                    'response_code': result.get('ResponseCode'),
-                    'response_description': result.get('ResponseDescription'),
-                    'customer_message': result.get('CustomerMessage')
+                    'success': False,
+                    'error_code': 'MPESA',
+                    'error': result.get('ResponseDescription') or 'STK push rejected'
                 }
-            else:
-                raise Exception(f"STK push failed: {response.status_code}")
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
-
-# Configuration
-MPESA_CONFIG = {
-    'consumer_key': 'your_consumer_key_here',
-    'consumer_secret': 'your_consumer_secret_here',
-    'paybill': '123456',
-    'environment': 'sandbox'
-}
-
-# Initialize M-Pesa integration
-mpesa = MpesaSTKPush(
-    consumer_key=MPESA_CONFIG['consumer_key'],
-    consumer_secret=MPESA_CONFIG['consumer_secret'],
-    paybill=MPESA_CONFIG['paybill'],
-    environment=MPESA_CONFIG['environment']
-)
-
-def process_payment(phone_number, amount, package_name, user_id):
-    """Process payment for FortuNet"""
-    try:
-        # Format phone number
-        if phone_number.startswith('0'):
-            phone_number = '254' + phone_number[1:]
-        elif phone_number.startswith('+'):
-            phone_number = phone_number[1:]
-        
-        # Generate reference
-        account_reference = f"FortuNet-{user_id}-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-        callback_url = "https://your-domain.com/api/mpesa-callback"
-        
-        # Initiate STK push
-        result = mpesa.initiate_stk_push(
-            phone_number=phone_number,
-            amount=amount,
-            package_name=package_name,
-            account_reference=account_reference,
-            callback_url=callback_url
-        )
-        
-        return result
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
+            
+            return {
+                'success': True,
+                'checkout_request_id': result.get('CheckoutRequestID'),
+                'merchant_request_id': result.get('MerchantRequestID'),
+                'response_code': result['ResponseCode'],
+                'response_description': result.get('ResponseDescription'),
+                'customer_message': result.get('CustomerMessage')
+            }
+        except requests.HTTPError as e:
+            # Daraja answered with a 4xx/5xx
+            return {'success': False, 'error_code': 'MPESA', 'error': f"STK push failed: {e.response.status_code}"}
+        except requests.RequestException:
+            logger.exception("Could not reach M-Pesa")
+            return {'success': False, 'error_code': 'NETWORK', 'error': 'Could not reach M-Pesa'}
+        except (MpesaError, ValueError) as e:
+            # ValueError: Daraja sent a body that isn't JSON
+            return {'success': False, 'error_code': 'MPESA', 'error': str(e) or 'Invalid M-Pesa response'}
+
+# M-Pesa integration, created on first use so each Gunicorn worker
+# builds its own session after forking
+_mpesa = None
+_mpesa_lock = threading.Lock()
+
+def get_mpesa():
+    """Shared MpesaSTKPush instance for this process, built from config.py"""
+    global _mpesa
+    if _mpesa is None:
+        with _mpesa_lock:
+            if _mpesa is None:
+                config = get_config()
+                redis_client = None
+                if redis is not None and config.REDIS_URL:
+                    redis_client = redis.Redis.from_url(config.REDIS_URL)
+                _mpesa = MpesaSTKPush(
+                    consumer_key=config.MPESA_CONSUMER_KEY,
+                    consumer_secret=config.MPESA_CONSUMER_SECRET,
+                    paybill=config.MPESA_PAYBILL,
+                    passkey=config.MPESA_PASSKEY,
+                    environment=config.MPESA_ENVIRONMENT,
+                    redis_client=redis_client
+                )
+    return _mpesa
+
+# Kenyan mobile number as 07XX/01XX, 2547XX or +2547XX; group 1 is the
+# nine digits after the country code
+_MSISDN_RE = re.compile(r'(?:\+?254|0)?([71]\d{8})')
+
+def normalize_phone_number(phone_number):
+    """Convert 07XX / +2547XX numbers to 2547XX, or None if it isn't a mobile number"""
+    match = _MSISDN_RE.fullmatch(phone_number.strip())
+    if match is None:
+        return None
+    return '254' + match.group(1)
+
+def process_payment(phone_number, amount, package_name, payment_id):
+    """Process payment for FortuNet
+
+    payment_id is the payment_requests row id; Daraja caps AccountReference
+    at 12 characters, so the reference is built from it alone.
+    """
+    # Format phone number; Daraja would reject anything else after a round-trip
+    phone_number = normalize_phone_number(phone_number)
+    if phone_number is None:
+        return {'success': False, 'error_code': 'BAD_MSISDN', 'error': 'Invalid phone number'}
+    
+    # Generate reference; ids are never reused, so it is unique across workers
+    account_reference = f"FN{payment_id}"
+    # The password and the request must carry the same timestamp
+    timestamp = make_timestamp()
+    # The token lets mpesa_callback tell Daraja's callbacks from forged ones
+    config = get_config()
+    callback_url = f"{config.MPESA_CALLBACK_URL}?{urlencode({'token': config.MPESA_CALLBACK_TOKEN})}"
+    
+    # Initiate STK push; network and Daraja failures come back as
+    # {'success': False, ...}
+    result = get_mpesa().initiate_stk_push(
+        phone_number=phone_number,
+        amount=amount,
+        package_name=package_name,
+        account_reference=account_reference,
+        callback_url=callback_url,
+        timestamp=timestamp
+    )
+    
+    return result
+
+def process_payments_batch(items, max_workers=16):
+    """Process several payments concurrently
+
+    items is a list of process_payment keyword arguments. The pushes share
+    get_mpesa()'s pooled session and cached access token; results come back in
+    the same order as items.
+    """
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(lambda item: process_payment(**item), items))
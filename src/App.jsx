@@ -14,6 +14,22 @@ import {
   LogOut
 } from "lucide-react";
 
+// Poll a queued STK push until it has been sent to the phone or has failed
+const waitForStkPush = async (trackingId, timeoutMs = 30000) => {
+  const deadline = Date.now() + timeoutMs;
+  while (Date.now() < deadline) {
+    const response = await fetch(`http://localhost:5000/api/payment-status/${trackingId}`);
+    const payment = await response.json();
+    if (!response.ok) {
+      throw new Error(payment.error || 'Could not check payment status');
+    }
+    if (payment.status !== 'pending') {
+      return payment;
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+  throw new Error('M-Pesa is taking too long to respond. Please try again.');
+};
 
 export default function App() {
   // User session state
@@ -181,13 +197,19 @@ export default function App() {
       
       const data = await response.json();
       
-      if (data.success) {
+      if (!response.ok || !data.trackingId) {
+        throw new Error(data.error || 'Payment initiation failed');
+      }
+      
+      // The push is sent in the background; only report it once it has gone out
+      const payment = await waitForStkPush(data.trackingId);
+      if (payment.status === 'sent') {
         alert('STK push sent! Please check your phone and enter M-Pesa PIN to complete payment.');
         setShowPaymentModal(false);
         setPhoneNumber('');
         setSelectedPackage(null);
       } else {
-        throw new Error(data.error || 'Payment initiation failed');
+        throw new Error(payment.error || 'Payment initiation failed');
       }
       
     } catch (error) {
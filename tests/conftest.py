@@ -0,0 +1,17 @@
+import os
+import sys
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A fresh Database in a temporary file"""
+    database = Database(str(tmp_path / 'hotspot.db'))
+    yield database
+    database.close()
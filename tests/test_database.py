@@ -0,0 +1,266 @@
+import hashlib
+import sqlite3
+import time
+
+import pytest
+
+import database
+from database import Database
+
+
+def _reopen_at_version(path, version):
+    """Mark the file as written by an older release so init_database migrates it"""
+    conn = sqlite3.connect(path)
+    conn.execute(f'PRAGMA user_version = {version}')
+    conn.commit()
+    conn.close()
+    return Database(path)
+
+
+@pytest.fixture
+def nairobi_time(monkeypatch):
+    """Run with the server clock at UTC+3"""
+    if not hasattr(time, 'tzset'):
+        pytest.skip('time.tzset is not available')
+    monkeypatch.setenv('TZ', 'Africa/Nairobi')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_local_package_expiries_are_migrated_to_utc(tmp_path, nairobi_time):
+    path = str(tmp_path / 'hotspot.db')
+    db = Database(path)
+    user = db.create_user('alice', 'secret', '254712345678')
+    db.close()
+
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        UPDATE users SET current_package_id = 1, package_expires_at = '2020-01-01 02:30:00.123456'
+    ''')
+    conn.commit()
+    conn.close()
+
+    db = _reopen_at_version(path, 4)
+    try:
+        assert db.get_user_by_id(user['id'])['package_expires_at'] == '2019-12-31 23:30:00'
+        assert db.check_user_package_status(user['id'])['has_active_package'] is False
+    finally:
+        db.close()
+
+
+def test_utc_package_expiries_are_left_alone(tmp_path, nairobi_time):
+    path = str(tmp_path / 'hotspot.db')
+    db = Database(path)
+    user = db.create_user('alice', 'secret', '254712345678')
+    db.assign_package_to_user(user['id'], db.get_packages_by_type('daily')[0]['id'])
+    expires_at = db.get_user_by_id(user['id'])['package_expires_at']
+    db.close()
+
+    db = _reopen_at_version(path, 4)
+    try:
+        assert db.get_user_by_id(user['id'])['package_expires_at'] == expires_at
+        assert db.check_user_package_status(user['id'])['has_active_package'] is True
+    finally:
+        db.close()
+
+
+def _legacy_user(db, path, password):
+    """Create a user stored the way accounts were before scrypt"""
+    user = db.create_user('alice', 'placeholder', '254712345678')
+    conn = sqlite3.connect(path)
+    conn.execute('UPDATE users SET password = ?, password_salt = NULL WHERE id = ?',
+                 (hashlib.sha256(password.encode()).hexdigest(), user['id']))
+    conn.commit()
+    conn.close()
+    return user
+
+
+def _stored_hash(path, user_id):
+    conn = sqlite3.connect(path)
+    row = conn.execute('SELECT password, password_salt FROM users WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_legacy_password_is_rehashed_on_login(tmp_path):
+    path = str(tmp_path / 'hotspot.db')
+    db = Database(path)
+    try:
+        user = _legacy_user(db, path, 'hunter2')
+
+        assert db.verify_password('alice', 'hunter2')['id'] == user['id']
+
+        password, salt = _stored_hash(path, user['id'])
+        assert salt is not None
+        assert password != hashlib.sha256(b'hunter2').hexdigest()
+        assert db.verify_password('alice', 'hunter2')['id'] == user['id']
+        assert db.verify_password('alice', 'wrong') is None
+    finally:
+        db.close()
+
+
+def test_legacy_password_is_kept_after_failed_login(tmp_path):
+    path = str(tmp_path / 'hotspot.db')
+    db = Database(path)
+    try:
+        user = _legacy_user(db, path, 'hunter2')
+        before = _stored_hash(path, user['id'])
+
+        assert db.verify_password('alice', 'wrong') is None
+        assert _stored_hash(path, user['id']) == before
+    finally:
+        db.close()
+
+
+def _package_id(db):
+    return db.get_packages_by_type('daily')[0]['id']
+
+
+def test_create_transactions_inserts_pending_rows(db):
+    user = db.create_user('alice', 'secret', '254712345678')
+    package_id = _package_id(db)
+    rows = [
+        {'user_id': user['id'], 'package_id': package_id, 'amount': 50,
+         'payment_method': 'mpesa', 'phone_number': '254712345678', 'transaction_id': f'ws_{i}'}
+        for i in range(3)
+    ]
+    rows.append({'user_id': user['id'], 'package_id': package_id, 'amount': 20,
+                 'payment_method': 'voucher', 'phone_number': '254712345678'})
+
+    assert db.create_transactions(rows) == 4
+    assert db.create_transactions([]) == 0
+
+    transactions = db.get_user_transactions(user['id'])
+    assert len(transactions) == 4
+    assert {t['status'] for t in transactions} == {'pending'}
+    assert db.get_transaction_by_checkout_id('ws_2')['amount'] == 50
+
+
+def test_create_transaction_returns_new_row(db):
+    user = db.create_user('alice', 'secret', '254712345678')
+    first = db.create_transaction(user['id'], _package_id(db), 50, 'mpesa', '254712345678', 'ws_1')
+    second = db.create_transaction(user['id'], _package_id(db), 50, 'mpesa', '254712345678', 'ws_2')
+
+    assert second['id'] == first['id'] + 1
+    assert first['created_at'] is not None
+    assert db.get_transaction_by_checkout_id('ws_1')['id'] == first['id']
+
+
+def test_pre_versioned_database_is_migrated(tmp_path):
+    path = str(tmp_path / 'hotspot.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            phone_number TEXT NOT NULL,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1,
+            mikrotik_user_id TEXT,
+            current_package_id INTEGER,
+            package_expires_at TIMESTAMP
+        );
+        INSERT INTO users (username, password, phone_number) VALUES ('bob', 'x', '254700000000');
+    ''')
+    conn.close()
+
+    db = Database(path)
+    try:
+        conn = sqlite3.connect(path)
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == database._SCHEMA_VERSION
+        user_columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+        assert {'mac_address', 'password_salt'} <= user_columns
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'idx_users_mac', 'idx_tx_user', 'idx_tx_checkout'} <= indexes
+        conn.close()
+
+        assert db.get_user_by_username('bob')['phone_number'] == '254700000000'
+        assert db.get_packages_by_type('daily')
+    finally:
+        db.close()
+
+
+def test_reopening_current_schema_keeps_data(tmp_path):
+    path = str(tmp_path / 'hotspot.db')
+    db = Database(path)
+    db.create_user('alice', 'secret', '254712345678')
+    packages = len(db.get_packages_by_type('daily'))
+    db.close()
+
+    db = Database(path)
+    try:
+        assert db.get_user_by_username('alice') is not None
+        assert len(db.get_packages_by_type('daily')) == packages
+    finally:
+        db.close()
+
+
+def test_complete_payment_settles_transaction_and_activates_package(db):
+    user = db.create_user('alice', 'secret', '254712345678')
+    package_id = _package_id(db)
+    transaction = db.create_transaction(user['id'], package_id, 50, 'mpesa', '254712345678', 'ws_CO_1')
+
+    db.complete_payment(transaction['id'], user['id'], package_id)
+
+    settled = db.get_transaction_by_checkout_id('ws_CO_1')
+    assert settled['status'] == 'completed'
+    assert settled['completed_at'] is not None
+    user = db.get_user_by_id(user['id'])
+    assert user['current_package_id'] == package_id
+    assert user['package_expires_at'] is not None
+    assert user['last_login'] is not None
+
+
+def test_complete_payment_rolls_back_when_package_is_missing(db):
+    user = db.create_user('alice', 'secret', '254712345678')
+    transaction = db.create_transaction(user['id'], _package_id(db), 50, 'mpesa', '254712345678', 'ws_CO_1')
+
+    with pytest.raises(ValueError):
+        db.complete_payment(transaction['id'], user['id'], 9999)
+
+    assert db.get_transaction_by_checkout_id('ws_CO_1')['status'] == 'pending'
+    assert db.get_user_by_id(user['id'])['current_package_id'] is None
+
+
+def test_complete_payment_rejects_unknown_transaction(db):
+    user = db.create_user('alice', 'secret', '254712345678')
+    with pytest.raises(ValueError):
+        db.complete_payment(9999, user['id'], _package_id(db))
+
+
+def test_payment_request_ids_are_not_reused(db):
+    first = db.create_payment_request('a')
+    db.finish_payment_request('a', 'sent', checkout_request_id='ws_1')
+    assert db.create_payment_request('b') == first + 1
+    assert db.get_payment_request('a')['status'] == 'sent'
+
+
+def test_payment_requests_without_ids_are_migrated(tmp_path):
+    path = str(tmp_path / 'hotspot.db')
+    Database(path).close()
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        DROP TABLE payment_requests;
+        CREATE TABLE payment_requests (
+            tracking_id TEXT PRIMARY KEY,
+            status TEXT DEFAULT 'pending',
+            checkout_request_id TEXT,
+            customer_message TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO payment_requests (tracking_id, status) VALUES ('old', 'sent');
+    ''')
+    conn.close()
+
+    db = _reopen_at_version(path, 3)
+    try:
+        assert db.get_payment_request('old')['status'] == 'sent'
+        assert db.create_payment_request('new') == 2
+    finally:
+        db.close()
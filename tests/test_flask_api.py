@@ -0,0 +1,221 @@
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+import pytest
+
+import flask_api_endpoints
+from flask_api_endpoints import _AdminBatcher
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return flask_api_endpoints.create_app().test_client()
+
+
+class _Promise:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class _Resource:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.removed = []
+
+    def get_async(self, **query):
+        if not isinstance(query['.id'], str):
+            raise AttributeError("'int' object has no attribute 'encode'")
+        return _Promise([row for row in self.rows if row['.id'] == query['.id']])
+
+    def add_async(self, **fields):
+        return _Promise([])
+
+    def remove_async(self, id):
+        self.removed.append(id)
+        return _Promise([])
+
+
+class _Api:
+    def __init__(self):
+        self.resources = {
+            '/ip/hotspot/active': _Resource([{'.id': '*1', 'address': '10.0.0.5', 'user': 'alice'}]),
+            '/ip/firewall/address-list': _Resource(),
+        }
+
+    def get_resource(self, path):
+        return self.resources[path]
+
+
+def test_bad_op_only_fails_its_own_future():
+    batch = [('block', 5, Future()), ('block', '*1', Future()), ('disconnect', '*2', Future())]
+
+    _AdminBatcher()._send(_Api(), batch)
+
+    assert isinstance(batch[0][2].exception(), AttributeError)
+    assert batch[1][2].result() is True
+    assert batch[2][2].result() is True
+
+
+@pytest.mark.parametrize('path', ['/api/disconnect-users', '/api/block-users'])
+@pytest.mark.parametrize('ids', ['*1', [5], [['*1']], [{'id': '*1'}]])
+def test_bulk_admin_routes_reject_non_string_ids(client, monkeypatch, path, ids):
+    monkeypatch.setattr(flask_api_endpoints._admin_batcher, 'submit',
+                        lambda *args: pytest.fail('submitted a malformed id'))
+
+    response = client.post(path, json={'ids': ids})
+
+    assert response.status_code == 400
+    assert response.json == {'error': 'ids must be a list of strings'}
+
+
+def _stk_callback(result_code, checkout_request_id='ws_CO_1'):
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': 'mr_1',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.',
+    }}}
+
+
+@pytest.fixture
+def paid_setup(client, db, monkeypatch):
+    """A pending M-Pesa transaction and a callback route wired to db"""
+    monkeypatch.setattr(flask_api_endpoints, 'get_db', lambda: db)
+    monkeypatch.setattr(flask_api_endpoints, 'MPESA_CALLBACK_TOKEN', 's3cret')
+    activated = []
+    monkeypatch.setattr(flask_api_endpoints, 'activate_user_package',
+                        lambda user_id, package_id: activated.append((user_id, package_id)))
+    user = db.create_user('alice', 'secret', '254712345678')
+    package_id = db.get_packages_by_type('daily')[0]['id']
+    db.create_transaction(user['id'], package_id, 50, 'mpesa', '254712345678', 'ws_CO_1')
+    return user, package_id, activated
+
+
+def test_mpesa_callback_completes_payment_and_activates_user(client, db, paid_setup):
+    user, package_id, activated = paid_setup
+
+    response = client.post('/api/mpesa-callback?token=s3cret', json=_stk_callback(0))
+    client.post('/api/mpesa-callback?token=s3cret', json=_stk_callback(0))
+
+    assert response.status_code == 200
+    assert db.get_transaction_by_checkout_id('ws_CO_1')['status'] == 'completed'
+    assert db.get_user_by_id(user['id'])['current_package_id'] == package_id
+    assert activated == [(user['id'], package_id)]
+
+
+def test_mpesa_callback_records_failed_payment(client, db, paid_setup):
+    user, _, activated = paid_setup
+
+    client.post('/api/mpesa-callback?token=s3cret', json=_stk_callback(1032))
+
+    assert db.get_transaction_by_checkout_id('ws_CO_1')['status'] == 'failed'
+    assert db.get_user_by_id(user['id'])['current_package_id'] is None
+    assert activated == []
+
+
+@pytest.mark.parametrize('query', ['', '?token=', '?token=guess'])
+def test_mpesa_callback_rejects_missing_token(client, db, paid_setup, query):
+    response = client.post('/api/mpesa-callback' + query, json=_stk_callback(0))
+
+    assert response.status_code == 403
+    assert db.get_transaction_by_checkout_id('ws_CO_1')['status'] == 'pending'
+
+
+def test_mpesa_callback_rejects_everything_without_configured_token(client, db, paid_setup, monkeypatch):
+    monkeypatch.setattr(flask_api_endpoints, 'MPESA_CALLBACK_TOKEN', '')
+
+    assert client.post('/api/mpesa-callback?token=', json=_stk_callback(0)).status_code == 403
+
+
+def test_mpesa_callback_rejects_flat_body(client, paid_setup):
+    response = client.post('/api/mpesa-callback?token=s3cret',
+                           json={'ResultCode': 0, 'CheckoutRequestID': 'ws_CO_1'})
+    assert response.status_code == 400
+
+
+def test_activate_user_package_sets_profile_on_router(db, monkeypatch):
+    monkeypatch.setattr(flask_api_endpoints, 'get_db', lambda: db)
+    user = db.create_user('alice', 'secret', '254712345678')
+    package = db.get_packages_by_type('daily')[0]
+    updates = []
+
+    class Users:
+        def get(self, name):
+            return [{'id': '*7', 'name': name}] if name == 'alice' else []
+
+        def set(self, **fields):
+            updates.append(fields)
+
+    class Api:
+        def get_resource(self, path):
+            assert path == '/ip/hotspot/user'
+            return Users()
+
+    @contextmanager
+    def router():
+        yield Api()
+
+    monkeypatch.setattr(flask_api_endpoints, 'mikrotik_api', router)
+
+    flask_api_endpoints.activate_user_package(user['id'], package['id'])
+
+    assert updates == [{'id': '*7', 'profile': package['name'],
+                        'limit-uptime': f"{package['duration_hours']}h"}]
+
+
+PAYMENT = {'phoneNumber': '0712345678', 'packageId': 1, 'amount': 50, 'packageName': 'Daily'}
+
+
+@pytest.fixture
+def queued(db, monkeypatch):
+    """Capture STK pushes instead of sending them"""
+    monkeypatch.setattr(flask_api_endpoints, 'get_db', lambda: db)
+    pushes = []
+    monkeypatch.setattr(flask_api_endpoints.PAYMENT_POOL, 'submit',
+                        lambda fn, *args, **kwargs: pushes.append((args, kwargs)))
+    return pushes
+
+
+def test_initiate_payment_queues_push_as_pending(client, db, queued):
+    response = client.post('/api/initiate-payment', json={**PAYMENT, 'phoneNumber': '+254712345678'})
+
+    assert response.status_code == 202
+    assert response.json['success'] is False
+    assert response.json['status'] == 'pending'
+    (tracking_id,), payment = queued[0]
+    assert tracking_id == response.json['trackingId']
+    assert payment['phone_number'] == '254712345678'
+
+    status = client.get(f'/api/payment-status/{tracking_id}')
+    assert status.json['status'] == 'pending'
+
+
+def test_initiate_payment_rejects_bad_phone_before_queueing(client, queued):
+    response = client.post('/api/initiate-payment', json={**PAYMENT, 'phoneNumber': '12345'})
+
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid phone number'}
+    assert queued == []
+
+
+def test_send_stk_push_records_outcome(db, monkeypatch):
+    import mpesa_stkpush
+    monkeypatch.setattr(flask_api_endpoints, 'get_db', lambda: db)
+    results = iter([
+        {'success': True, 'checkout_request_id': 'ws_CO_1', 'customer_message': 'Check your phone'},
+        {'success': False, 'error_code': 'MPESA', 'error': 'Invalid Access Token'},
+    ])
+    monkeypatch.setattr(mpesa_stkpush, 'process_payment', lambda **payment: next(results))
+    db.create_payment_request('sent')
+    db.create_payment_request('failed')
+
+    flask_api_endpoints.send_stk_push('sent', phone_number='254712345678')
+    flask_api_endpoints.send_stk_push('failed', phone_number='254712345678')
+
+    assert db.get_payment_request('sent')['checkout_request_id'] == 'ws_CO_1'
+    assert db.get_payment_request('failed')['status'] == 'failed'
+    assert db.get_payment_request('failed')['error'] == 'Invalid Access Token'
@@ -0,0 +1,83 @@
+import datetime
+import sqlite3
+
+import pytest
+from flask import Flask, jsonify
+
+import flask_helpers
+from flask_helpers import ORJSONProvider, etagged
+
+
+def _json_app():
+    app = Flask(__name__)
+    app.json = ORJSONProvider(app)
+    return app
+
+
+def test_json_provider_serializes_rows_as_objects():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT 1 AS id, 'Daily' AS name").fetchone()
+    app = _json_app()
+
+    with app.app_context():
+        response = jsonify({'packages': [row]})
+
+    assert response.json == {'packages': [{'id': 1, 'name': 'Daily'}]}
+
+
+@pytest.mark.skipif(flask_helpers.orjson is None, reason='orjson is not installed')
+def test_json_provider_keeps_naive_datetimes_unlabelled():
+    app = _json_app()
+    local = datetime.datetime(2026, 10, 15, 23, 30, 0)
+
+    with app.app_context():
+        body = app.json.dumps({'created_at': local})
+
+    # Naive values are local time, so no UTC offset may be added
+    assert 'Z' not in body and '+00:00' not in body
+
+
+def _etag_client():
+    app = Flask(__name__)
+    body = {'value': 1}
+
+    @app.route('/data')
+    @etagged
+    def data():
+        return jsonify(body)
+
+    @app.route('/missing')
+    @etagged
+    def missing():
+        return jsonify({'error': 'not found'}), 404
+
+    return app.test_client(), body
+
+
+def test_etagged_answers_matching_poll_with_304():
+    client, body = _etag_client()
+
+    first = client.get('/data')
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+    assert etag.startswith('W/')
+    assert first.headers['Cache-Control'] == 'private, max-age=2'
+
+    repeat = client.get('/data', headers={'If-None-Match': etag})
+    assert repeat.status_code == 304
+    assert repeat.data == b''
+    assert repeat.headers['ETag'] == etag
+    assert repeat.headers['Cache-Control'] == 'private, max-age=2'
+
+    body['value'] = 2
+    changed = client.get('/data', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_etagged_leaves_errors_untagged():
+    client, _ = _etag_client()
+    response = client.get('/missing')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
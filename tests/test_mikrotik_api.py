@@ -0,0 +1,159 @@
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+import mikrotik_api
+from mikrotik_api import MikroTikAPI
+
+
+@pytest.fixture
+def router(monkeypatch):
+    """A MikroTikAPI whose RouterOS calls are answered by router.replies"""
+    api = MikroTikAPI.__new__(MikroTikAPI)
+    api.replies = []
+    api.calls = 0
+
+    def call(fn):
+        api.calls += 1
+        reply = api.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    api._call_with_reconnect = call
+    yield api
+    for name in ('_fetch_system_info', '_fetch_active_sessions', '_fetch_hotspot_users',
+                 '_fetch_hotspot_profile_names', '_fetch_user_counts'):
+        mikrotik_api.invalidate_cache(api, name)
+
+
+def test_router_errors_are_not_cached(router):
+    router.replies = [OSError('connection reset'), [{'name': 'pppoe-10M'}, {'name': 'default'}]]
+
+    assert router.get_hotspot_profile_names() == []
+    assert router.get_hotspot_profile_names() == ['pppoe-10M', 'default']
+    assert router.calls == 2
+
+
+def test_successful_reads_are_cached(router):
+    router.replies = [[{'name': 'default'}]]
+
+    assert router.get_hotspot_profile_names() == ['default']
+    assert router.get_hotspot_profile_names() == ['default']
+    assert router.calls == 1
+
+
+def test_user_counts_are_not_cached_when_profile_lookup_fails(router):
+    counts = {'active': 3, 'users': 7, 'pppoe': 2, 'static': 0}
+    router.replies = [OSError('timed out'), [{'name': 'pppoe-10M'}], counts]
+
+    assert router.get_user_counts() == {'active': 0, 'users': 0, 'pppoe': 0, 'static': 0}
+    assert router.get_user_counts() == counts
+
+
+@pytest.fixture
+def plans_file(tmp_path, monkeypatch):
+    path = tmp_path / 'internet_plans.json'
+    monkeypatch.setattr(mikrotik_api, 'PLANS_FILE', str(path))
+    monkeypatch.setattr(mikrotik_api, '_plans_cache', None)
+    return path
+
+
+def test_concurrent_plan_creates_are_all_saved(plans_file):
+    plan = {'name': 'Daily', 'price': 50, 'speed': '5M/5M', 'duration': '1d', 'data_limit': '2G'}
+    statuses = []
+
+    def create():
+        client = mikrotik_api.app.test_client()
+        for _ in range(5):
+            statuses.append(client.post('/api/internet-plans', json=plan).status_code)
+
+    threads = [threading.Thread(target=create) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [201] * 40
+    plans = mikrotik_api.load_plans()
+    assert sorted(p['id'] for p in plans) == list(range(1, 41))
+    assert [p.name for p in plans_file.parent.iterdir() if p.suffix == '.tmp'] == []
+
+
+class _FlakyRouter:
+    """Pool whose first call fails at the socket level after the router ran it"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.sent = []
+
+    @contextmanager
+    def acquire(self):
+        yield self
+
+    def get_resource(self, path):
+        router = self
+
+        class Resource:
+            def get(self):
+                return router.send(('get', path))
+
+            def add(self, **fields):
+                return router.send(('add', path))
+
+        return Resource()
+
+    def send(self, command):
+        self.sent.append(command)
+        if len(self.sent) == 1:
+            raise OSError('connection reset by peer')
+        return self.rows
+
+
+@pytest.fixture
+def flaky_router():
+    api = MikroTikAPI.__new__(MikroTikAPI)
+    api.pool = _FlakyRouter([{'name': 'alice'}])
+    yield api
+    for name in ('_fetch_hotspot_users', '_fetch_user_counts'):
+        mikrotik_api.invalidate_cache(api, name)
+
+
+def test_reads_are_retried_after_a_socket_error(flaky_router):
+    assert [user.username for user in flaky_router.get_hotspot_users()] == ['alice']
+    assert flaky_router.pool.sent == [('get', '/ip/hotspot/user')] * 2
+
+
+def test_writes_are_not_resent_after_a_socket_error(flaky_router):
+    assert flaky_router.create_hotspot_user('bob', 'secret') is False
+    assert flaky_router.pool.sent == [('add', '/ip/hotspot/user')]
+
+
+PLAN = {'name': 'Daily', 'price': 50, 'speed': '5M/5M', 'duration': '1d', 'data_limit': '2G'}
+
+
+def test_plan_accepts_valid_body():
+    assert mikrotik_api._validate_plan(PLAN) is None
+    assert mikrotik_api._validate_plan({**PLAN, 'description': 'One day', 'is_active': False}) is None
+
+
+@pytest.mark.parametrize('body, error', [
+    ('plan', 'Request body must be a JSON object'),
+    ({k: v for k, v in PLAN.items() if k != 'speed'}, 'speed is required'),
+    ({**PLAN, 'name': ''}, 'name is required'),
+    ({**PLAN, 'price': '50'}, 'Invalid value for field: price'),
+    ({**PLAN, 'price': True}, 'Invalid value for field: price'),
+    ({**PLAN, 'is_active': 1}, 'Invalid value for field: is_active'),
+    ({**PLAN, 'description': 5}, 'Invalid value for field: description'),
+])
+def test_plan_rejects_malformed_body(body, error):
+    assert mikrotik_api._validate_plan(body) == error
+
+
+def test_create_plan_route_rejects_malformed_body(plans_file):
+    response = mikrotik_api.app.test_client().post('/api/internet-plans', json={**PLAN, 'price': 'free'})
+
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid value for field: price'}
+    assert not plans_file.exists()
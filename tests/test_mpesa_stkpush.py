@@ -0,0 +1,124 @@
+import base64
+import json
+
+import pytest
+
+import mpesa_stkpush
+from mpesa_stkpush import MpesaSTKPush
+
+
+class _OAuthResponse:
+    status_code = 200
+    content = json.dumps({'access_token': 'tok', 'expires_in': '3599'}).encode()
+
+
+class _Session:
+    """Stands in for requests.Session, counting OAuth round-trips"""
+
+    def __init__(self):
+        self.token_fetches = 0
+
+    def get(self, url, **kwargs):
+        self.token_fetches += 1
+        return _OAuthResponse()
+
+
+def _client(redis_client=None):
+    mpesa = MpesaSTKPush('key', 'secret', '174379', 'passkey', redis_client=redis_client)
+    mpesa._session = _Session()
+    return mpesa
+
+
+def test_access_token_is_shared_through_redis():
+    fakeredis = pytest.importorskip('fakeredis')
+    shared = fakeredis.FakeRedis()
+    first, second = _client(shared), _client(shared)
+
+    assert first.get_access_token() == 'tok'
+    assert second.get_access_token() == 'tok'
+
+    assert first._session.token_fetches == 1
+    assert second._session.token_fetches == 0
+    assert 3500 < shared.ttl('mpesa:token') <= 3599
+    assert second._stk_headers['Authorization'] == 'Bearer tok'
+
+
+def test_access_token_falls_back_when_redis_is_down():
+    redis = pytest.importorskip('redis')
+
+    class Down:
+        def pipeline(self):
+            raise redis.ConnectionError('refused')
+
+        def set(self, *args, **kwargs):
+            raise redis.ConnectionError('refused')
+
+    mpesa = _client(Down())
+    assert mpesa.get_access_token() == 'tok'
+    assert mpesa.get_access_token() == 'tok'
+    assert mpesa._session.token_fetches == 1
+
+
+def test_password_is_base64_of_shortcode_passkey_timestamp():
+    mpesa = _client()
+    password = mpesa.generate_password('20261015120000')
+    assert base64.b64decode(password) == b'174379passkey20261015120000'
+
+
+def test_get_mpesa_is_built_from_config(monkeypatch):
+    import config
+    monkeypatch.setattr(mpesa_stkpush, '_mpesa', None)
+    monkeypatch.setattr(config.DevelopmentConfig, 'MPESA_PAYBILL', '600999')
+    monkeypatch.setattr(config.DevelopmentConfig, 'MPESA_PASSKEY', 'from-config')
+    monkeypatch.setattr(config.DevelopmentConfig, 'REDIS_URL', '')
+    monkeypatch.setenv('FLASK_ENV', 'development')
+
+    mpesa = mpesa_stkpush.get_mpesa()
+
+    assert mpesa is mpesa_stkpush.get_mpesa()
+    assert mpesa.paybill == '600999'
+    assert mpesa.passkey == 'from-config'
+    assert mpesa.environment == config.DevelopmentConfig.MPESA_ENVIRONMENT
+    mpesa.close()
+
+
+def test_account_reference_fits_daraja_limit(monkeypatch):
+    pushes = []
+
+    class Recorder:
+        def initiate_stk_push(self, **push):
+            pushes.append(push)
+            return {'success': True}
+
+    monkeypatch.setattr(mpesa_stkpush, 'get_mpesa', Recorder)
+
+    mpesa_stkpush.process_payment('0712345678', 50, 'Daily', payment_id=9999999999)
+
+    assert pushes[0]['account_reference'] == 'FN9999999999'
+    assert len(pushes[0]['account_reference']) <= 12
+    assert pushes[0]['phone_number'] == '254712345678'
+
+
+@pytest.mark.parametrize('number, expected', [
+    ('0712345678', '254712345678'),
+    ('712345678', '254712345678'),
+    ('254712345678', '254712345678'),
+    ('+254712345678', '254712345678'),
+    (' 0712345678 ', '254712345678'),
+    ('0112345678', '254112345678'),
+])
+def test_normalize_phone_number(number, expected):
+    assert mpesa_stkpush.normalize_phone_number(number) == expected
+
+
+@pytest.mark.parametrize('number', ['', '12345', '0812345678', '07123456789', '+1712345678', '07-1234-5678'])
+def test_normalize_phone_number_rejects_non_mobile(number):
+    assert mpesa_stkpush.normalize_phone_number(number) is None
+
+
+def test_process_payment_rejects_bad_number_without_calling_daraja(monkeypatch):
+    monkeypatch.setattr(mpesa_stkpush, 'get_mpesa', lambda: pytest.fail('called Daraja'))
+
+    result = mpesa_stkpush.process_payment('12345', 50, 'Daily', payment_id=1)
+
+    assert result == {'success': False, 'error_code': 'BAD_MSISDN', 'error': 'Invalid phone number'}
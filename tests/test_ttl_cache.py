@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+import flask_api_endpoints
+from flask_api_endpoints import ttl_cache
+
+
+@pytest.fixture(autouse=True)
+def no_redis(monkeypatch):
+    """Keep every cache in this process"""
+    monkeypatch.setattr(flask_api_endpoints, '_redis', None)
+
+
+def test_ttl_cache_reuses_result_until_it_expires():
+    calls = []
+
+    @ttl_cache(seconds=0.05)
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    assert load() == 1
+    assert load() == 1
+    time.sleep(0.1)
+    assert load() == 2
+
+
+def test_ttl_cache_keys_on_arguments():
+    calls = []
+
+    @ttl_cache(seconds=60)
+    def load(key):
+        calls.append(key)
+        return key.upper()
+
+    assert load('a') == 'A'
+    assert load('b') == 'B'
+    assert load('a') == 'A'
+    assert calls == ['a', 'b']
+
+
+def _slow_loader(started, release):
+    """A cached function that blocks until release is set and counts its calls"""
+    calls = []
+
+    @ttl_cache(seconds=60)
+    def load(key):
+        calls.append(key)
+        started.set()
+        release.wait(5)
+        return len(calls)
+
+    return load, calls
+
+
+def _start(func, *args):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func(*args)))
+    thread.start()
+    return thread, results
+
+
+def test_cache_clear_drops_cached_results():
+    calls = []
+
+    @ttl_cache(seconds=60)
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    assert load() == 1
+    load.cache_clear()
+    assert load() == 2
+
+
+def test_cache_clear_discards_load_in_flight():
+    started, release = threading.Event(), threading.Event()
+    load, calls = _slow_loader(started, release)
+
+    thread, results = _start(load, 'a')
+    assert started.wait(5)
+    load.cache_clear()
+    release.set()
+    thread.join(5)
+
+    # The caller still gets its value, but it isn't cached past the clear
+    assert results == [1]
+    assert load('a') == 2
+    assert load('a') == 2
+
+
+def test_ttl_cache_single_flights_concurrent_misses():
+    started, release = threading.Event(), threading.Event()
+    load, calls = _slow_loader(started, release)
+
+    threads = [_start(load, 'a') for _ in range(8)]
+    assert started.wait(5)
+    time.sleep(0.05)
+    release.set()
+    for thread, _ in threads:
+        thread.join(5)
+
+    assert calls == ['a']
+    assert [results[0] for _, results in threads] == [1] * 8
+    assert load('a') == 1
+
+
+def test_ttl_cache_retries_after_leader_fails():
+    calls = []
+
+    @ttl_cache(seconds=60)
+    def load():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('router unreachable')
+        return len(calls)
+
+    with pytest.raises(RuntimeError):
+        load()
+    assert load() == 2
+    assert load() == 2
+
+
+def test_shared_cache_is_reused_across_workers(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    monkeypatch.setattr(flask_api_endpoints, '_redis', fakeredis.FakeRedis())
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return [{'user': 'alice'}]
+
+    # Two decorations of the same key stand in for two Gunicorn workers
+    worker_a = ttl_cache(seconds=60, shared_key='test:active')(fetch)
+    worker_b = ttl_cache(seconds=60, shared_key='test:active')(fetch)
+
+    assert worker_a() == [{'user': 'alice'}]
+    assert worker_b() == [{'user': 'alice'}]
+    assert len(calls) == 1
+
+    worker_a.cache_clear()
+    worker_b.cache_clear()
+    assert worker_b() == [{'user': 'alice'}]
+    assert len(calls) == 2
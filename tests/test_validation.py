@@ -0,0 +1,23 @@
+import pytest
+
+from flask_api_endpoints import _validate_payment_request
+
+PAYMENT = {'phoneNumber': '0712345678', 'packageId': 1, 'amount': 50, 'packageName': 'Daily'}
+
+
+def test_payment_request_accepts_valid_body():
+    assert _validate_payment_request(PAYMENT) is None
+    assert _validate_payment_request({**PAYMENT, 'amount': 49.5}) is None
+
+
+@pytest.mark.parametrize('body, error', [
+    (None, 'Request body must be a JSON object'),
+    ([PAYMENT], 'Request body must be a JSON object'),
+    ({k: v for k, v in PAYMENT.items() if k != 'packageId'}, 'Missing required field: packageId'),
+    ({**PAYMENT, 'amount': '50'}, 'Invalid value for field: amount'),
+    ({**PAYMENT, 'amount': True}, 'Invalid value for field: amount'),
+    ({**PAYMENT, 'packageId': 1.0}, 'Invalid value for field: packageId'),
+    ({**PAYMENT, 'phoneNumber': 712345678}, 'Invalid value for field: phoneNumber'),
+])
+def test_payment_request_rejects_malformed_body(body, error):
+    assert _validate_payment_request(body) == error